@@ -15,6 +15,9 @@ from MMD_Lib import *
 from data_hand import *
 from skimage.measure import compare_ssim
 import skimage as skimage
+import sys
+sys.path.append('./src')
+from replay_buffer import ReplayBuffer, balanced_counts
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '5,6'
 
@@ -105,44 +108,9 @@ def my_gumbel_softmax_sample(logits, cats_range, temperature=0.1):
     return logits_with_noise
 
 def load_mnist(dataset_name):
-    data_dir = os.path.join("./data", dataset_name)
-
-    def extract_data(filename, num_data, head_size, data_size):
-        with gzip.open(filename) as bytestream:
-            bytestream.read(head_size)
-            buf = bytestream.read(data_size * num_data)
-            data = np.frombuffer(buf, dtype=np.uint8).astype(np.float)
-        return data
-
-    data = extract_data(data_dir + '/train-images-idx3-ubyte.gz', 60000, 16, 28 * 28)
-    trX = data.reshape((60000, 28, 28, 1))
-
-    data = extract_data(data_dir + '/train-labels-idx1-ubyte.gz', 60000, 8, 1)
-    trY = data.reshape((60000))
-
-    data = extract_data(data_dir + '/t10k-images-idx3-ubyte.gz', 10000, 16, 28 * 28)
-    teX = data.reshape((10000, 28, 28, 1))
-
-    data = extract_data(data_dir + '/t10k-labels-idx1-ubyte.gz', 10000, 8, 1)
-    teY = data.reshape((10000))
-
-    trY = np.asarray(trY)
-    teY = np.asarray(teY)
-
-    X = np.concatenate((trX, teX), axis=0)
-    y = np.concatenate((trY, teY), axis=0).astype(np.int)
-
-    seed = 547
-    np.random.seed(seed)
-    np.random.shuffle(X)
-    np.random.seed(seed)
-    np.random.shuffle(y)
-
-    y_vec = np.zeros((len(y), 10), dtype=np.float)
-    for i, label in enumerate(y):
-        y_vec[i, y[i]] = 1.0
-
-    return X / 255., y_vec
+    # ---- same loader as data_hand, backed by the memory-mapped uint8 cache
+    X, y = load_mnist_uint8(dataset_name)
+    return normalize_batch(X), one_hot(y)
 
 def My_Encoder_mnist(image, z_dim, name, batch_size=64, reuse=False):
     with tf.variable_scope(name) as scope:
@@ -232,6 +200,11 @@ class LifeLone_MNIST(object):
         self.learning_rate = 0.0002
         self.beta1 = 0.5
 
+        #when set to a byte budget, the teacher generations mixed into the student batches
+        #go through a fixed-size task-balanced replay buffer instead of fixed slices
+        self.studentReplayBytes = None
+        self.studentReplay = None
+
         self.VAE_List = []
         self.VAE_GeneratorList = []
         self.EncoderMean_List = []
@@ -1082,6 +1055,19 @@ class LifeLone_MNIST(object):
 
         return minIndex, minFid
 
+    def Give_StudentBatch(self, batch_images, generations, counts):
+        if self.studentReplayBytes is None:
+            parts = [generations[i][0:counts[i]] for i in range(len(generations))]
+            return np.concatenate(parts + [batch_images[0:counts[-1]]], 0)
+
+        if self.studentReplay is None:
+            self.studentReplay = ReplayBuffer(self.studentReplayBytes, np.shape(batch_images)[1:], np.float32)
+        for teacherIndex in range(len(generations)):
+            self.studentReplay.add(generations[teacherIndex], teacherIndex)
+        n_new = balanced_counts(self.batch_size, len(generations) + 1)[-1]
+        replayed = self.studentReplay.sample(self.batch_size - n_new)
+        return np.concatenate((replayed, batch_images[0:n_new]), 0)
+
     def train(self):
 
         taskCount = 4
@@ -1179,7 +1165,7 @@ class LifeLone_MNIST(object):
                                 feed_dict={self.inputs: batch_images, self.z: batch_z})
 
                             data1 = self.sess.run(self.VAE1_generation,feed_dict={self.z:batch_z})
-                            data = np.concatenate((data1[0:32],batch_images[0:32]),0)
+                            data = self.Give_StudentBatch(batch_images, [data1], [32, 32])
                             _ = self.sess.run(
                                 [self.vae_student],
                                 feed_dict={self.inputs: data, self.z: batch_z})
@@ -1192,7 +1178,7 @@ class LifeLone_MNIST(object):
                             data1 = self.sess.run(self.VAE1_generation, feed_dict={self.z: batch_z})
                             data2 = self.sess.run(self.VAE2_generation, feed_dict={self.z: batch_z})
 
-                            data = np.concatenate((data1[0:20], data2[0:20],batch_images[0:24]), 0)
+                            data = self.Give_StudentBatch(batch_images, [data1, data2], [20, 20, 24])
                             _ = self.sess.run(
                                 [self.vae_student],
                                 feed_dict={self.inputs: data, self.z: batch_z})
@@ -1206,7 +1192,7 @@ class LifeLone_MNIST(object):
                             data2 = self.sess.run(self.VAE2_generation, feed_dict={self.z: batch_z})
                             data3 = self.sess.run(self.VAE3_generation, feed_dict={self.z: batch_z})
 
-                            data = np.concatenate((data1[0:15], data2[0:15], data3[0:15],batch_images[0:19]), 0)
+                            data = self.Give_StudentBatch(batch_images, [data1, data2, data3], [15, 15, 15, 19])
                             _ = self.sess.run(
                                 [self.vae_student],
                                 feed_dict={self.inputs: data, self.z: batch_z})
@@ -1221,7 +1207,7 @@ class LifeLone_MNIST(object):
                             data3 = self.sess.run(self.VAE3_generation, feed_dict={self.z: batch_z})
                             data4 = self.sess.run(self.VAE4_generation, feed_dict={self.z: batch_z})
 
-                            data = np.concatenate((data1[0:12], data2[0:12], data3[0:12], data4[0:12],batch_images[0:16]), 0)
+                            data = self.Give_StudentBatch(batch_images, [data1, data2, data3, data4], [12, 12, 12, 12, 16])
                             _ = self.sess.run(
                                 [self.vae_student],
                                 feed_dict={self.inputs: data, self.z: batch_z})
@@ -193,7 +193,7 @@ for taskIndex in range(taskCount):
             grads = tape.gradient(loss, trainable_weights)
             optimizer.apply_gradients(zip(grads, trainable_weights))
 
-            model.currentNode.logLikelihood = res
+            model.currentNode.Update_LogLikelihood(res)
 
             if step % 200 == 0:
                 # ---- monitor the test-set
@@ -151,23 +151,28 @@ step = 0
 for taskIndex in range(taskCount):
     if taskIndex == 0:
         currentX = CaltechTraining
-        currentNet = model.Create_New_Component(myInput, currentX[0:1000],True)
+        model.biasInitializer = utils.get_bias("task", currentX)
+        currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]),True)
     elif taskIndex == 1:
         currentX = omnistTrainingSet
         model.SetTranable(False)
-        currentNet = model.Create_New_Component(myInput, currentX[0:1000], False)
+        model.biasInitializer = utils.get_bias("task", currentX)
+        currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]), False)
     elif taskIndex == 2:
         currentX = fashionTrain
         model.SetTranable(False)
-        currentNet = model.Create_New_Component(myInput, currentX[0:1000], False)
+        model.biasInitializer = utils.get_bias("task", currentX)
+        currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]), False)
     elif taskIndex == 3:
         currentX = mnistTrain
         model.SetTranable(False)
-        currentNet = model.Create_New_Component(myInput, currentX[0:1000], False)
+        model.biasInitializer = utils.get_bias("task", currentX)
+        currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]), False)
     elif taskIndex == 4:
         currentX = ifashionTrainX
         model.SetTranable(False)
-        currentNet = model.Create_New_Component(myInput, currentX[0:1000], False)
+        model.biasInitializer = utils.get_bias("task", currentX)
+        currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]), False)
 
     model.currentIndex = taskIndex
     epochs = 500
@@ -205,7 +210,7 @@ for taskIndex in range(taskCount):
             grads = tape.gradient(loss, trainable_weights)
             optimizer.apply_gradients(zip(grads, trainable_weights))
 
-            model.currentNode.logLikelihood = res
+            model.currentNode.Update_LogLikelihood(res)
 
             if step % 200 == 0:
                 # ---- monitor the test-set
@@ -90,12 +90,13 @@ if args.stochastic_layers == 1:
     n_hidden = [200]
     #model = iwae1.IWAE(n_hidden[0], n_latent[0])
     model = DMix_Weighted.DMix_Weighted(n_hidden[0], n_latent[0])
+    model.biasInitializer = utils.get_bias("fashion", Xtrain)
     model.threshold = 35
     #model.Create_New_Component(myInput,0)
 else:
     n_latent = [100, 50]
     n_hidden = [200, 100]
-    model = iwae2.IWAE(n_hidden, n_latent)
+    model = iwae2.IWAE(n_hidden, n_latent, bias_initializer=utils.get_bias("fashion", Xtrain))
 
 myInput = tf.keras.layers.Input(shape=(28*28,))
 
@@ -193,7 +194,7 @@ for taskIndex in range(taskCount):
             grads = tape.gradient(loss, trainable_weights)
             optimizer.apply_gradients(zip(grads, trainable_weights))
 
-            model.currentNode.logLikelihood = res
+            model.currentNode.Update_LogLikelihood(res)
 
             if step % 200 == 0:
                 # ---- monitor the test-set
@@ -0,0 +1,147 @@
+import tensorflow as tf
+from tensorflow_probability import distributions as tfd
+from tensorflow import keras
+import numpy as np
+import os
+import argparse
+import datetime
+import time
+import sys
+sys.path.insert(0, './src')
+import utils
+import input_pipeline
+import DMix
+import graph_checkpoint
+import parallel_runs
+from data_hand import *
+from keras.utils import to_categorical
+from Utils2 import *
+from utils import *
+
+# ---- DMix_VAE_5MNIST_Threshold20/60 for a list of thresholds. The threshold only matters
+# from the second task on, when Create_New_Component decides between a basic and a
+# specific node, so the first task is trained once and saved; every threshold branch
+# then restores that graph in its own process and trains tasks 2-5.
+parser = argparse.ArgumentParser()
+parser.add_argument("--stochastic_layers", type=int, default=1, choices=[1, 2], help="number of stochastic layers in the model")
+parser.add_argument("--n_samples", type=int, default=50, help="number of importance samples")
+parser.add_argument("--batch_size", type=int, default=64, help="batch size")
+parser.add_argument("--objective", type=str, default="vae_elbo", choices=["vae_elbo", "iwae_elbo", "iwae_eq14", "vae_elbo_kl"])
+parser.add_argument("--gpu", type=str, default='3', help="Choose GPU")
+parser.add_argument("--thresholds", type=str, default="20,60", help="comma separated expansion thresholds")
+parser.add_argument("--prefix", type=str, default="/tmp/iwae/threshold_sweep/prefix.npz", help="where the trained first task is saved")
+parser.add_argument("--branch_threshold", type=float, default=None, help="train tasks 2-5 from the saved prefix with this threshold (set by the sweep)")
+parallel_runs.add_arguments(parser)
+args = parser.parse_args()
+print(args)
+parallel_runs.setup(args, shared=True)
+
+# ---- set the visible GPU devices
+os.environ["CUDA_VISIBLE_DEVICES"] = args.gpu
+
+# ---- dynamic GPU memory allocation
+gpus = tf.config.list_physical_devices('GPU')
+if gpus:
+    tf.config.experimental.set_memory_growth(gpus[0], True)
+
+# ---- set random seeds
+np.random.seed(123)
+tf.random.set_seed(123)
+
+# ---- load data
+(Xtrain, ytrain), (Xtest, ytest) = Give_KerasDataset("mnist")
+
+# ---- binarize the test data once, as DMix_VAE_5MNIST_Threshold20/60 do; the seed above
+# makes it the same in the prefix process and every threshold branch
+Xtest = utils.bernoullisample(Xtest)
+
+n_samples = args.n_samples
+batch_size = args.batch_size
+
+model = DMix.DMix(200, 100)
+myInput = tf.keras.layers.Input(shape=(28*28,))
+
+optimizer = keras.optimizers.Adam(0.0001, epsilon=1e-4)
+
+#Split MNIST into Five tasks
+y_train = to_categorical(ytrain, num_classes=10)
+ytest = to_categorical(ytest, num_classes=10)
+arr1, labelArr1, arr2, labelArr2, arr3, labelArr3, arr4, labelArr4, arr5, labelArr5 = Split_dataset_by5(
+    Xtrain,
+    y_train)
+
+arr1_test, labelArr1_test, arr2_test, labelArr2_test, arr3_test, labelArr3_test, arr4_test, labelArr4, arr5_test, labelArr5_test = Split_dataset_by5(
+    Xtest,
+    ytest)
+
+taskArr = [arr1, arr2, arr3, arr4, arr5]
+testArr = [arr1_test, arr2_test, arr3_test, arr4_test, arr5_test]
+taskCount = 5
+epochs = 500
+
+
+def train_task(currentNet, currentX, taskIndex, step):
+    start = time.time()
+    # ---- batches are shuffled and binarized afresh every epoch inside the tf.data pipeline
+    trainStream = input_pipeline.BinarizedStream(currentX, batch_size, seed=taskIndex)
+    for epoch in range(epochs):
+        for batchImages in trainStream.epoch(epoch):
+            step = step + 1
+            step = step %100000
+
+            with tf.GradientTape() as tape:
+                if currentNet.IsBasic == True:
+                    res = currentNet.Build_BasicNode(batchImages, n_samples)
+                else:
+                    res = currentNet.Build_NormalNode(batchImages,model.BasicNodeArr,model.basic_number,model.Componentweights,model.n_samples)
+
+                loss = -res
+
+            trainable_weights = currentNet.trainable_variables
+            grads = tape.gradient(loss, trainable_weights)
+            optimizer.apply_gradients(zip(grads, trainable_weights))
+
+            model.currentNode.Update_LogLikelihood(res)
+
+            if step % 200 == 0:
+                took = time.time() - start
+                start = time.time()
+                print("epoch {0}/{1}, train ELBO: {2:.2f}, time: {3:.2f}".format(epoch, epochs, res, took))
+    return step
+
+
+L = 5000
+if args.branch_threshold is None:
+    # ---- the shared prefix, then one process per threshold
+    currentNet = model.Create_New_Component(myInput, arr1[0:1000], True)
+    model.currentIndex = 0
+    step = train_task(currentNet, arr1, 0, 0)
+    print("first task")
+    print(model.Calculate_NLL_By_SelectedComponent(0, L, arr1_test.astype(np.float32)))
+    graph_checkpoint.save_graph(model, args.prefix, {"taskIndex": 0, "step": step})
+
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+    resultsArr = parallel_runs.run_branches(args, [("threshold{0}".format(t), ["--branch_threshold", str(t)]) for t in thresholds])
+    for result in resultsArr:
+        print("threshold {0}: mean NLL {1:.4f}, basic nodes {2}, per task {3}".format(
+            result["threshold"], result["mean"], result["basic_number"], result["values"]))
+else:
+    extra = graph_checkpoint.restore_graph(model, args.prefix)
+    step = extra["step"]
+    model.threshold = args.branch_threshold
+    for taskIndex in range(extra["taskIndex"] + 1, taskCount):
+        model.SetTranable(False)
+        currentNet = model.Create_New_Component(myInput, taskArr[taskIndex][0:1000], False)
+        model.currentIndex = taskIndex
+        step = train_task(currentNet, taskArr[taskIndex], taskIndex, step)
+
+    values = []
+    for testX in testArr:
+        index, value = model.Evaluation(testX.astype(np.float32), L)
+        values.append(float(value))
+    print(values)
+    print(np.mean(values))
+    print(model.basic_number)
+    if args.result_file != "":
+        parallel_runs.write_result(args.result_file, {"threshold": args.branch_threshold, "values": values,
+                                                      "mean": float(np.mean(values)), "basic_number": int(model.basic_number)})
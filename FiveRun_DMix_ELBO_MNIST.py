@@ -9,6 +9,11 @@ import time
 import sys
 sys.path.insert(0, './src')
 import utils
+import input_pipeline
+import parallel_runs
+import prefix_cache
+import graph_checkpoint
+import early_stopping
 import iwae1
 import iwae2
 import DMix
@@ -27,8 +32,20 @@ parser.add_argument("--epochs", type=int, default=-1,
                          "will be set based on the learning rate scheme from the paper")
 parser.add_argument("--objective", type=str, default="vae_elbo", choices=["vae_elbo", "iwae_elbo", "iwae_eq14", "vae_elbo_kl"])
 parser.add_argument("--gpu", type=str, default='2', help="Choose GPU")
+parser.add_argument("--prefix_cache", type=str, default="",
+                    help="directory of trained task prefixes shared between experiments, empty to disable")
+parser.add_argument("--checkpoint", type=str, default="",
+                    help="directory of per-run training checkpoints, a restarted run resumes from its checkpoint; empty to disable")
+parser.add_argument("--checkpoint_every", type=float, default=600., help="seconds between two checkpoints of a running task")
+parser.add_argument("--patience", type=int, default=0,
+                    help="held-out checks without improvement before a task stops early, 0 trains every task for 500 epochs")
+parser.add_argument("--min_delta", type=float, default=0.1, help="smallest held-out ELBO gain that counts as an improvement")
+parser.add_argument("--eval_every", type=int, default=5, help="epochs between two held-out checks")
+parser.add_argument("--validation_size", type=int, default=1000, help="examples of every task held out for early stopping")
+parallel_runs.add_arguments(parser)
 args = parser.parse_args()
 print(args)
+parallel_runs.setup(args)
 
 # ---- string describing the experiment, to use in tensorboard and plots
 string = "main_{0}_{1}_{2}".format(args.objective, args.stochastic_layers, args.n_samples)
@@ -62,17 +79,16 @@ else:
 
 # ---- load data
 RunCount = 5
-resultsArr = []
-for runIndex in range(RunCount):
+# ---- with --workers > 1 the runs execute in child processes and only their results come back here
+resultsArr = parallel_runs.run_parallel(args, RunCount)
+for runIndex in parallel_runs.run_indices(args, RunCount):
+    parallel_runs.seed_run(runIndex)
 
-    (Xtrain, ytrain), (Xtest, ytest) = keras.datasets.mnist.load_data()
+    # ---- flattened [N, 784] images in [0, 1], memory-mapped and shared by parallel workers
+    (Xtrain, ytrain), (Xtest, ytest) = Give_KerasDataset("mnist")
     Ntrain = Xtrain.shape[0]
     Ntest = Xtest.shape[0]
 
-    # ---- reshape to vectors
-    Xtrain = Xtrain.reshape(Ntrain, -1) / 255
-    Xtest = Xtest.reshape(Ntest, -1) / 255
-
     # ---- experiment settings
     objective = args.objective
     # n_latent = args.n_latent
@@ -137,12 +153,42 @@ for runIndex in range(RunCount):
         Xtest,
         ytest)
 
+    # ---- the binarized test splits are kept bit-packed, 98 bytes per image
+    arr1_test, arr2_test, arr3_test, arr4_test, arr5_test = [input_pipeline.PackedBits(a) for a in
+                                                             (arr1_test, arr2_test, arr3_test, arr4_test, arr5_test)]
+
     taskCount = 5
 
     pz = tfd.Normal(0, 1)
     step = 0
-    for taskIndex in range(taskCount):
-        if taskIndex == 0:
+    # ---- tasks already trained by an experiment with the same model, data and seed are restored
+    taskArr = [arr1, arr2, arr3, arr4, arr5]
+    firstTask = 0
+    if args.prefix_cache != "":
+        prefixCache = prefix_cache.PrefixCache(args.prefix_cache)
+        prefixKeys = prefixCache.keys(model, {"n_samples": n_samples, "mixture_n_samples": model.n_samples,
+                                              "batch_size": batch_size, "threshold": model.threshold,
+                                              "epochs": 500, "learning_rate": learning_rate_dict[0],
+                                              "early_stopping": [args.patience, args.min_delta, args.eval_every, args.validation_size]},
+                                      taskArr, runIndex)
+        firstTask, prefixState = prefixCache.restore_deepest(model, prefixKeys)
+        step = prefixState.get("step", 0)
+    # ---- a checkpoint of this run, if there is one, is further than any cached prefix
+    checkpoint = None
+    if args.checkpoint != "":
+        checkpoint = graph_checkpoint.TrainingCheckpoint(os.path.join(args.checkpoint, "run{0}.npz".format(runIndex)),
+                                                         args.checkpoint_every, optimizer)
+        if checkpoint.restore(model):
+            firstTask = checkpoint.first_task()
+            step = checkpoint.state["step"]
+    stopper = None
+    if args.patience > 0:
+        stopper = early_stopping.EarlyStopping(args.patience, args.min_delta, args.eval_every, seed=runIndex)
+    for taskIndex in range(firstTask, taskCount):
+        if checkpoint is not None and checkpoint.resumes_task(taskIndex):
+            currentX = taskArr[taskIndex]
+            currentNet = model.currentNode
+        elif taskIndex == 0:
             currentX = arr1
             currentNet = model.Create_New_Component(myInput, currentX[0:1000],True)
         elif taskIndex == 1:
@@ -164,26 +210,23 @@ for runIndex in range(RunCount):
 
         model.currentIndex = taskIndex
         epochs = 500
-
-        for epoch in range(epochs):
-
-            # ---- binarize the training data at the start of each epoch
-            Xtrain_binarized = utils.bernoullisample(currentX)
-
-            n_examples = np.shape(Xtrain_binarized)[0]
-            index = [i for i in range(n_examples)]
-            np.random.shuffle(index)
-            Xtrain_binarized = Xtrain_binarized[index]
-            counter = 0
-
-            myCount = int(np.shape(Xtrain_binarized)[0]/batch_size)
-
+        if stopper is not None:
+            # ---- the last validation_size examples of the task are held out from training
+            validX = currentX[-args.validation_size:]
+            currentX = currentX[:-args.validation_size]
+            stopper.begin(currentNet, validX)
+
+        # ---- the task data is kept as uint8, shuffled and binarized per batch on the fly
+        trainStream = input_pipeline.BinarizedStream(currentX, batch_size, seed=runIndex * taskCount + taskIndex)
+        startEpoch, startBatch = checkpoint.position(taskIndex) if checkpoint is not None else (0, 0)
+        for epoch in range(startEpoch, epochs):
             print(taskIndex)
-            for idx in range(myCount):
+            # ---- an interrupted epoch continues after its last checkpointed batch
+            skip = startBatch if epoch == startEpoch else 0
+            for batchIndex, batchImages in enumerate(trainStream.epoch(epoch).skip(skip), skip):
                 step = step + 1
                 step = step %100000
 
-                batchImages = Xtrain_binarized[idx*batch_size:(idx+1)*batch_size]
                 beta = 1.0
                 #res = model.train_step(batchImages, n_samples, beta, optimizer, objective=objective)
                 with tf.GradientTape() as tape:
@@ -199,7 +242,9 @@ for runIndex in range(RunCount):
                 grads = tape.gradient(loss, trainable_weights)
                 optimizer.apply_gradients(zip(grads, trainable_weights))
 
-                model.currentNode.logLikelihood = res
+                model.currentNode.Update_LogLikelihood(res)
+                if checkpoint is not None:
+                    checkpoint.maybe_save(model, taskIndex, epoch, batchIndex + 1, step)
 
                 if step % 200 == 0:
                     # ---- monitor the test-set
@@ -214,14 +259,28 @@ for runIndex in range(RunCount):
                     #      .format(epoch, epochs, 0, total_steps, res[objective].numpy(), test_res[objective], took))
                     print("epoch {0}/{1}, step {2}/{3}, train ELBO: {4:.2f}, val ELBO: {5:.2f}, time: {6:.2f}"
                           .format(epoch, epochs, 0, total_steps, res, 0, took))
+            if stopper is not None and stopper.update(currentNet, epoch):
+                break
+        if stopper is not None:
+            stopper.finish(currentNet, taskIndex, epoch)
+
+        if args.prefix_cache != "":
+            prefixCache.save(model, prefixKeys[taskIndex], {"taskIndex": taskIndex, "step": step})
+        if checkpoint is not None:
+            checkpoint.save_task(model, taskIndex, step)
 
         if taskIndex == 0:
             L = 5000
-            value1 = model.Calculate_NLL_By_SelectedComponent(0, L, arr1_test.astype(np.float32))
+            value1 = model.Calculate_NLL_By_SelectedComponent(0, L, arr1_test)
             print("first task")
             print(value1)
 
 
+    if checkpoint is not None:
+        checkpoint.close()
+    if stopper is not None:
+        print("stop epoch of every task: {0}".format(stopper.stopEpochs))
+
     '''
     model.save_weights('/tmp/iwae/{0}/final_weights'.format(string))
     
@@ -229,18 +288,20 @@ for runIndex in range(RunCount):
     model.load_weights('/tmp/iwae/{0}/final_weights'.format(string))
     '''
     L = 5000
-    index1,value1 = model.Evaluation(arr1_test.astype(np.float32),L)
-    index2,value2 = model.Evaluation(arr2_test.astype(np.float32),L)
-    index3,value3 = model.Evaluation(arr3_test.astype(np.float32),L)
-    index4,value4 = model.Evaluation(arr4_test.astype(np.float32),L)
-    index5,value5 = model.Evaluation(arr5_test.astype(np.float32),L)
+    index1,value1 = model.Evaluation(arr1_test,L)
+    index2,value2 = model.Evaluation(arr2_test,L)
+    index3,value3 = model.Evaluation(arr3_test,L)
+    index4,value4 = model.Evaluation(arr4_test,L)
+    index5,value5 = model.Evaluation(arr5_test,L)
 
     sum = value1+value2+value3+value4+value5
     sum = sum/5.0
     resultsArr.append(sum)
+    parallel_runs.record_run(args, runIndex, sum)
 
+parallel_runs.save_result(args, resultsArr)
 resultsArr = np.array(resultsArr)
-for i in range(RunCount):
+for i in range(len(resultsArr)):
     print("Test-set {0} sample log likelihood estimate: {1:.4f}".format(5000, resultsArr[i]))
 
 print("mean")
@@ -10,6 +10,10 @@ import sys
 
 sys.path.insert(0, './src')
 import utils
+import input_pipeline
+import parallel_runs
+import replay
+import replay_buffer
 import iwae1
 import iwae2
 from data_hand import *
@@ -27,8 +31,18 @@ parser.add_argument("--epochs", type=int, default=-1,
 parser.add_argument("--objective", type=str, default="vae_elbo",
                     choices=["vae_elbo", "iwae_elbo", "iwae_eq14", "vae_elbo_kl"])
 parser.add_argument("--gpu", type=str, default='0', help="Choose GPU")
+parser.add_argument("--replay_mode", type=str, default="packed", choices=["packed", "lazy", "compact", "buffer"],
+                    help="replay samples generated once per task, drawn fresh for every batch, "
+                         "regenerated from stored seeds of every previous model, "
+                         "or kept in a fixed-size task-balanced replay buffer")
+parser.add_argument("--replay_ratio", type=float, default=0.5,
+                    help="fraction of every batch drawn from replay in lazy, compact and buffer replay modes")
+parser.add_argument("--replay_bytes", type=int, default=16 * 2 ** 20,
+                    help="memory cap of the replay buffer in buffer replay mode")
+parallel_runs.add_arguments(parser)
 args = parser.parse_args()
 print(args)
+parallel_runs.setup(args)
 
 # ---- string describing the experiment, to use in tensorboard and plots
 string = "main_{0}_{1}_{2}".format(args.objective, args.stochastic_layers, args.n_samples)
@@ -62,17 +76,16 @@ else:
 
 # ---- load data
 RunCount = 5
-resultsArr = []
-for runIndex in range(RunCount):
+# ---- with --workers > 1 the runs execute in child processes and only their results come back here
+resultsArr = parallel_runs.run_parallel(args, RunCount)
+for runIndex in parallel_runs.run_indices(args, RunCount):
+    parallel_runs.seed_run(runIndex)
 
-    (Xtrain, ytrain), (Xtest, ytest) = keras.datasets.fashion_mnist.load_data()
+    # ---- flattened [N, 784] images in [0, 1], memory-mapped and shared by parallel workers
+    (Xtrain, ytrain), (Xtest, ytest) = Give_KerasDataset("fashion_mnist")
     Ntrain = Xtrain.shape[0]
     Ntest = Xtest.shape[0]
 
-    # ---- reshape to vectors
-    Xtrain = Xtrain.reshape(Ntrain, -1) / 255
-    Xtest = Xtest.reshape(Ntest, -1) / 255
-
     # ---- experiment settings
     objective = args.objective
     # n_latent = args.n_latent
@@ -93,11 +106,11 @@ for runIndex in range(RunCount):
     if args.stochastic_layers == 1:
         n_latent = [100]
         n_hidden = [200]
-        model = iwae1.IWAE(n_hidden[0], n_latent[0])
+        model = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("fashion", Xtrain))
     else:
         n_latent = [100, 50]
         n_hidden = [200, 100]
-        model = iwae2.IWAE(n_hidden, n_latent)
+        model = iwae2.IWAE(n_hidden, n_latent, bias_initializer=utils.get_bias("fashion", Xtrain))
 
     learning_rate_dict[0] = 0.0001
     optimizer = keras.optimizers.Adam(learning_rate_dict[0], epsilon=1e-4)
@@ -131,6 +144,8 @@ for runIndex in range(RunCount):
 
     pz = tfd.Normal(0, 1)
     step = 0
+    replayStore = replay.CompactReplayStore(n_latent[-1], seed=runIndex)
+    replayBuffer = replay_buffer.ReplayBuffer(args.replay_bytes, seed=runIndex)
     for taskIndex in range(taskCount):
         if taskIndex == 0:
             currentX = arr1
@@ -143,36 +158,41 @@ for runIndex in range(RunCount):
         elif taskIndex == 4:
             currentX = arr5
 
-        if taskIndex != 0:
-            arr = []
-            myCount = int(np.shape(currentX)[0] / batch_size)
-            for i in range(myCount):
-                z = pz.sample([batch_size, n_latent[-1]])
-                generatedImages = model.generate_samples(z)
-                for j in range(batch_size):
-                    arr.append(generatedImages[j])
-            arr = np.array(arr)
-            currentX = np.concatenate((currentX, arr), axis=0)
+        replaySet = None
+        if taskIndex != 0 and args.replay_mode == "packed":
+            myCount = int(np.shape(currentX)[0]/batch_size)
+            # ---- generated samples are binary, kept bit-packed next to the task data
+            replaySet = input_pipeline.PackedBits(model.generate_replay(myCount * batch_size, dtype=np.uint8))
 
         epochs = 500
+        # ---- the task data is kept as uint8, shuffled and binarized per batch on the fly
+        if taskIndex != 0 and args.replay_mode == "lazy":
+            # ---- fresh samples from a frozen copy of the model as it was after the previous task
+            frozenModel = model.frozen_copy()
+            trainStream = input_pipeline.ReplayMixingStream(currentX, batch_size, frozenModel.replay_batch,
+                                                            args.replay_ratio, seed=runIndex * taskCount + taskIndex)
+        elif taskIndex != 0 and args.replay_mode == "compact":
+            # ---- only seeds are stored, replay images are regenerated by the frozen models;
+            # the store keeps every frozen copy, their weights count towards replayStore.nbytes
+            frozenModel = model.frozen_copy()
+            replayStore.add(lambda z, frozenModel=frozenModel: frozenModel.sample(z)[1], np.shape(currentX)[0],
+                            model=frozenModel)
+            trainStream = input_pipeline.ReplayMixingStream(currentX, batch_size, replayStore.generator(runIndex * taskCount + taskIndex),
+                                                            args.replay_ratio, seed=runIndex * taskCount + taskIndex)
+        elif taskIndex != 0 and args.replay_mode == "buffer":
+            # ---- samples of the previous model join the buffer under their own quota,
+            # which shrinks the quotas of older models to stay within replay_bytes
+            myCount = int(np.shape(currentX)[0]/batch_size)
+            replayBuffer.add(model.generate_replay(myCount * batch_size, dtype=np.uint8), taskIndex - 1)
+            trainStream = input_pipeline.ReplayMixingStream(currentX, batch_size, replay.buffer_generator(replayBuffer),
+                                                            args.replay_ratio, seed=runIndex * taskCount + taskIndex)
+        else:
+            trainStream = input_pipeline.BinarizedStream(currentX, batch_size, seed=runIndex * taskCount + taskIndex, replay=replaySet)
         for epoch in range(epochs):
-
-            # ---- binarize the training data at the start of each epoch
-            Xtrain_binarized = utils.bernoullisample(currentX)
-
-            n_examples = np.shape(Xtrain_binarized)[0]
-            index = [i for i in range(n_examples)]
-            np.random.shuffle(index)
-            Xtrain_binarized = Xtrain_binarized[index]
-            counter = 0
-
-            myCount = int(np.shape(Xtrain_binarized)[0] / batch_size)
-
-            for idx in range(myCount):
+            for batchImages in trainStream.epoch(epoch):
                 step = step + 1
                 step = step % 100000
 
-                batchImages = Xtrain_binarized[idx * batch_size:(idx + 1) * batch_size]
                 beta = 1.0
                 res = model.train_step(batchImages, n_samples, beta, optimizer, objective=objective)
 
@@ -210,9 +230,11 @@ for runIndex in range(RunCount):
     test_set_llh = test_elbo_metric.result()
     test_elbo_metric.reset_states()
     resultsArr.append(test_set_llh)
+    parallel_runs.record_run(args, runIndex, test_set_llh)
 
+parallel_runs.save_result(args, resultsArr)
 resultsArr = np.array(resultsArr)
-for i in range(RunCount):
+for i in range(len(resultsArr)):
     print("Test-set {0} sample log likelihood estimate: {1:.4f}".format(5000, resultsArr[i]))
 
 print("mean")
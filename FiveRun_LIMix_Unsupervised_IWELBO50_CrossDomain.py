@@ -10,6 +10,8 @@ import sys
 
 sys.path.insert(0, './src')
 import utils
+import input_pipeline
+import parallel_runs
 import InfiniteVAEMixture_Weighted
 from data_hand import *
 from keras.utils import to_categorical
@@ -26,8 +28,10 @@ parser.add_argument("--epochs", type=int, default=-1,
 parser.add_argument("--objective", type=str, default="iwae_elbo",
                     choices=["vae_elbo", "iwae_elbo", "iwae_eq14", "vae_elbo_kl"])
 parser.add_argument("--gpu", type=str, default='0', help="Choose GPU")
+parallel_runs.add_arguments(parser)
 args = parser.parse_args()
 print(args)
+parallel_runs.setup(args)
 
 # ---- string describing the experiment, to use in tensorboard and plots
 string = "main_{0}_{1}_{2}".format(args.objective, args.stochastic_layers, args.n_samples)
@@ -91,8 +95,10 @@ omnistTestingSet = utils.bernoullisample(omnistTestingSet)
 CaltechTraining,CaltechTesting = Load_Caltech101(True)
 
 RunCount = 5
-resultsArr = []
-for runIndex in range(RunCount):
+# ---- with --workers > 1 the runs execute in child processes and only their results come back here
+resultsArr = parallel_runs.run_parallel(args, RunCount)
+for runIndex in parallel_runs.run_indices(args, RunCount):
+    parallel_runs.seed_run(runIndex)
     # ---- experiment settings
     objective = args.objective
     # n_latent = args.n_latent
@@ -153,45 +159,39 @@ for runIndex in range(RunCount):
     for taskIndex in range(taskCount):
         if taskIndex == 0:
             currentX = CaltechTraining
-            currentNet = model.Create_New_Component(myInput, currentX[0:1000], True)
+            model.biasInitializer = utils.get_bias("task", currentX)
+            currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]), True)
         elif taskIndex == 1:
             currentX = omnistTrainingSet
             model.SetTranable(False)
-            currentNet = model.Create_New_Component(myInput, currentX[0:1000], False)
+            model.biasInitializer = utils.get_bias("task", currentX)
+            currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]), False)
         elif taskIndex == 2:
             currentX = fashionTrain
             model.SetTranable(False)
-            currentNet = model.Create_New_Component(myInput, currentX[0:1000], False)
+            model.biasInitializer = utils.get_bias("task", currentX)
+            currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]), False)
         elif taskIndex == 3:
             currentX = mnistTrain
             model.SetTranable(False)
-            currentNet = model.Create_New_Component(myInput, currentX[0:1000], False)
+            model.biasInitializer = utils.get_bias("task", currentX)
+            currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]), False)
         elif taskIndex == 4:
             currentX = ifashionTrainX
             model.SetTranable(False)
-            currentNet = model.Create_New_Component(myInput, currentX[0:1000], False)
+            model.biasInitializer = utils.get_bias("task", currentX)
+            currentNet = model.Create_New_Component(myInput, normalize_batch(currentX[0:1000]), False)
 
         model.currentIndex = taskIndex
         epochs = 500
+        # ---- the task data is kept as uint8, shuffled and binarized per batch on the fly
+        trainStream = input_pipeline.BinarizedStream(currentX, batch_size, seed=runIndex * taskCount + taskIndex)
         for epoch in range(epochs):
-
-            # ---- binarize the training data at the start of each epoch
-            Xtrain_binarized = utils.bernoullisample(currentX)
-
-            n_examples = np.shape(Xtrain_binarized)[0]
-            index = [i for i in range(n_examples)]
-            np.random.shuffle(index)
-            Xtrain_binarized = Xtrain_binarized[index]
-            counter = 0
-
-            myCount = int(np.shape(Xtrain_binarized)[0] / batch_size)
-
             print(taskIndex)
-            for idx in range(myCount):
+            for batchImages in trainStream.epoch(epoch):
                 step = step + 1
                 step = step % 100000
 
-                batchImages = Xtrain_binarized[idx * batch_size:(idx + 1) * batch_size]
                 beta = 1.0
                 # res = model.train_step(batchImages, n_samples, beta, optimizer, objective=objective)
                 with tf.GradientTape() as tape:
@@ -208,7 +208,7 @@ for runIndex in range(RunCount):
                 grads = tape.gradient(loss, trainable_weights)
                 optimizer.apply_gradients(zip(grads, trainable_weights))
 
-                model.currentNode.logLikelihood = res
+                model.currentNode.Update_LogLikelihood(res)
 
             if epoch % 10 == 0:
                     # ---- monitor the test-set
@@ -247,9 +247,11 @@ for runIndex in range(RunCount):
     print(sum)
     '''
     resultsArr.append(sum)
+    parallel_runs.record_run(args, runIndex, sum)
 
+parallel_runs.save_result(args, resultsArr)
 resultsArr = np.array(resultsArr)
-for i in range(RunCount):
+for i in range(len(resultsArr)):
     print("Test-set {0} sample log likelihood estimate: {1:.4f}".format(5000, resultsArr[i]))
 
 print("mean")
@@ -86,11 +86,11 @@ test_summary_writer = tf.summary.create_file_writer(test_log_dir)
 if args.stochastic_layers == 1:
     n_latent = [100]
     n_hidden = [200]
-    model = iwae1.IWAE(n_hidden[0], n_latent[0])
+    model = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("fashion", Xtrain))
 else:
     n_latent = [100, 50]
     n_hidden = [200, 100]
-    model = iwae2.IWAE(n_hidden, n_latent)
+    model = iwae2.IWAE(n_hidden, n_latent, bias_initializer=utils.get_bias("fashion", Xtrain))
 
 learning_rate_dict[0] = 0.0001
 optimizer = keras.optimizers.Adam(learning_rate_dict[0], epsilon=1e-4)
@@ -137,14 +137,8 @@ for taskIndex in range(taskCount):
         currentX = arr5
 
     if taskIndex != 0:
-        arr = []
         myCount = int(np.shape(currentX)[0]/batch_size)
-        for i in range(myCount):
-            z = pz.sample([batch_size, n_latent[-1]])
-            generatedImages = model.generate_samples(z)
-            for j in range(batch_size):
-                arr.append(generatedImages[j])
-        arr = np.array(arr)
+        arr = model.generate_replay(myCount * batch_size, dtype=np.float32)
         currentX = np.concatenate((currentX,arr),axis=0)
 
     epochs = 500
@@ -137,14 +137,8 @@ for taskIndex in range(taskCount):
         currentX = arr5
 
     if taskIndex != 0:
-        arr = []
         myCount = int(np.shape(currentX)[0]/batch_size)
-        for i in range(myCount):
-            z = pz.sample([batch_size, n_latent[-1]])
-            generatedImages = model.generate_samples(z)
-            for j in range(batch_size):
-                arr.append(generatedImages[j])
-        arr = np.array(arr)
+        arr = model.generate_replay(myCount * batch_size, dtype=np.float32)
         currentX = np.concatenate((currentX,arr),axis=0)
 
     epochs = 500
@@ -83,17 +83,20 @@ train_summary_writer = tf.summary.create_file_writer(train_log_dir)
 test_log_dir = "/tmp/iwae/{0}/".format(string) + current_time + "/test"
 test_summary_writer = tf.summary.create_file_writer(test_log_dir)
 
+# ---- the first task's data, the decoder bias starts from its statistics
+CaltechTraining,CaltechTesting = Load_Caltech101(True)
+
 # ---- instantiate the model, optimizer and metrics
 if args.stochastic_layers == 1:
     n_latent = [100]
     n_hidden = [200]
-    model = iwae1.IWAE(n_hidden[0], n_latent[0])
-    model2 = iwae1.IWAE(n_hidden[0], n_latent[0])
+    model = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("caltech101", CaltechTraining))
+    model2 = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("caltech101", CaltechTraining))
 else:
     n_latent = [100, 50]
     n_hidden = [200, 100]
-    model = iwae2.IWAE(n_hidden, n_latent)
-    model2 = iwae2.IWAE(n_hidden, n_latent)
+    model = iwae2.IWAE(n_hidden, n_latent, bias_initializer=utils.get_bias("caltech101", CaltechTraining))
+    model2 = iwae2.IWAE(n_hidden, n_latent, bias_initializer=utils.get_bias("caltech101", CaltechTraining))
 
 taskClassifier = TaskClassifier.TaskClassifier(n_hidden[0])
 
@@ -155,9 +158,8 @@ discrepancyArr = []
 targetArr = []
 sourceArr = []
 
-CaltechTraining,CaltechTesting = Load_Caltech101(True)
 
-classData = np.concatenate((CaltechTraining,fashionTrain[0:int(np.shape(CaltechTraining)[0]/2)],mnistTrain[0:int(np.shape(CaltechTraining)[0]/2)]),axis=0)
+classData = np.concatenate((CaltechTraining,normalize_batch(fashionTrain[0:int(np.shape(CaltechTraining)[0]/2)]),normalize_batch(mnistTrain[0:int(np.shape(CaltechTraining)[0]/2)])),axis=0)
 classY = np.zeros((np.shape(classData)[0],2))
 classY[0:np.shape(CaltechTraining)[0],0] = 1
 classY[np.shape(CaltechTraining)[0]:np.shape(classData)[0],1] = 1
@@ -232,16 +234,10 @@ for taskIndex in range(taskCount):
         currentX = RatedFashionTrain
 
     if taskIndex != 0:
-        arr = []
         myCount = int(np.shape(currentX)[0]/batch_size)
-        for i in range(myCount):
-            z = pz.sample([batch_size, n_latent[-1]])
-            generatedImages = model.generate_samples(z)
-            for j in range(batch_size):
-                arr.append(generatedImages[j])
-        arr = np.array(arr)
+        arr = model.generate_replay(myCount * batch_size, dtype=np.float32)
         currentGenerated = arr
-        currentX = np.concatenate((currentX,arr),axis=0)
+        currentX = np.concatenate((normalize_batch(currentX),arr),axis=0)
 
     epochs = 500
     for epoch in range(epochs):
@@ -11,6 +11,7 @@ sys.path.insert(0, './src')
 import utils
 import iwae1
 import iwae2
+import evaluation
 from data_hand import *
 from keras.utils import to_categorical
 
@@ -82,18 +83,21 @@ train_summary_writer = tf.summary.create_file_writer(train_log_dir)
 test_log_dir = "/tmp/iwae/{0}/".format(string) + current_time + "/test"
 test_summary_writer = tf.summary.create_file_writer(test_log_dir)
 
+# ---- the first task's data, the decoder bias starts from its statistics
+CaltechTraining,CaltechTesting = Load_Caltech101(True)
+
 # ---- instantiate the model, optimizer and metrics
 if args.stochastic_layers == 1:
     n_latent = [100]
     n_hidden = [200]
     #model = iwae1.IWAE(n_hidden[0], n_latent[0])
-    baseVAEModel = iwae1.IWAE(n_hidden[0], n_latent[0])
-    IWVAEModell = iwae1.IWAE(n_hidden[0], n_latent[0])
-    IWVAEModel2 = iwae1.IWAE(n_hidden[0], n_latent[0])
+    baseVAEModel = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("caltech101", CaltechTraining))
+    IWVAEModell = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("caltech101", CaltechTraining))
+    IWVAEModel2 = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("caltech101", CaltechTraining))
 else:
     n_latent = [100, 50]
     n_hidden = [200, 100]
-    model = iwae2.IWAE(n_hidden, n_latent)
+    model = iwae2.IWAE(n_hidden, n_latent, bias_initializer=utils.get_bias("caltech101", CaltechTraining))
 
 learning_rate_dict[0] = 0.0001
 optimizer = keras.optimizers.Adam(learning_rate_dict[0], epsilon=1e-4)
@@ -142,22 +146,17 @@ RatedMnistTest = utils.bernoullisample(RatedMnistTest)
 RatedFashionTest = utils.bernoullisample(RatedFashionTest)
 #omnistTestingSet = utils.bernoullisample(omnistTestingSet)
 
-CaltechTraining,CaltechTesting = Load_Caltech101(True)
 
 taskCount = 2
 
+evaluators = {}
+
 def EvaluationByModel(model,test):
-    test_elbo_metric = utils.MyMetric()
     L = 5000
-    # ---- since we are using 5000 importance samples we have to loop over each element of the test-set
-    for i, x in enumerate(test):
-        res = model(x[None, :].astype(np.float32), L)
-        test_elbo_metric.update_state(res['iwae_elbo'][None, None])
-        #if i % 200 == 0:
-        #    print("{0}/{1}".format(i, Ntest))
-
-    test_set_llh = test_elbo_metric.result()
-    test_elbo_metric.reset_states()
+    # ---- one batched evaluator per model, so its compiled tile is traced only once
+    if id(model) not in evaluators:
+        evaluators[id(model)] = evaluation.TestSetEvaluator(model, L, batch_size=20, sample_chunk=1000)
+    test_set_llh = evaluators[id(model)].evaluate(test)
     return test_set_llh
 
 
@@ -178,15 +177,9 @@ for taskIndex in range(taskCount):
         currentX = mnistTrain
 
     if taskIndex != 0:
-        arr = []
         myCount = int(np.shape(currentX)[0]/batch_size)
-        for i in range(myCount):
-            z = pz.sample([batch_size, n_latent[-1]])
-            generatedImages = baseVAEModel.generate_samples(z)
-            for j in range(batch_size):
-                arr.append(generatedImages[j])
-        arr = np.array(arr)
-        currentX = np.concatenate((currentX,arr),axis=0)
+        arr = baseVAEModel.generate_replay(myCount * batch_size, dtype=np.float32)
+        currentX = np.concatenate((normalize_batch(currentX),arr),axis=0)
     epochs = 500
     for epoch in range(epochs):
 
@@ -273,16 +266,5 @@ f.flush()
 f.close()
 
 def Evaluation(test):
-    test_elbo_metric = utils.MyMetric()
-    L = 5000
-    # ---- since we are using 5000 importance samples we have to loop over each element of the test-set
-    for i, x in enumerate(test):
-        res = model(x[None, :].astype(np.float32), L)
-        test_elbo_metric.update_state(res['iwae_elbo'][None, None])
-        #if i % 200 == 0:
-        #    print("{0}/{1}".format(i, Ntest))
-
-    test_set_llh = test_elbo_metric.result()
-    test_elbo_metric.reset_states()
-    return test_set_llh
+    return EvaluationByModel(model,test)
 
@@ -82,18 +82,21 @@ train_summary_writer = tf.summary.create_file_writer(train_log_dir)
 test_log_dir = "/tmp/iwae/{0}/".format(string) + current_time + "/test"
 test_summary_writer = tf.summary.create_file_writer(test_log_dir)
 
+# ---- the first task's data, the decoder bias starts from its statistics
+CaltechTraining,CaltechTesting = Load_Caltech101(True)
+
 # ---- instantiate the model, optimizer and metrics
 if args.stochastic_layers == 1:
     n_latent = [100]
     n_hidden = [200]
     #model = iwae1.IWAE(n_hidden[0], n_latent[0])
-    baseVAEModel = iwae1.IWAE(n_hidden[0], n_latent[0])
-    IWVAEModell = iwae1.IWAE(n_hidden[0], n_latent[0])
-    IWVAEModel2 = iwae1.IWAE(n_hidden[0], n_latent[0])
+    baseVAEModel = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("caltech101", CaltechTraining))
+    IWVAEModell = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("caltech101", CaltechTraining))
+    IWVAEModel2 = iwae1.IWAE(n_hidden[0], n_latent[0], bias_initializer=utils.get_bias("caltech101", CaltechTraining))
 else:
     n_latent = [100, 50]
     n_hidden = [200, 100]
-    model = iwae2.IWAE(n_hidden, n_latent)
+    model = iwae2.IWAE(n_hidden, n_latent, bias_initializer=utils.get_bias("caltech101", CaltechTraining))
 
 learning_rate_dict[0] = 0.0001
 optimizer = keras.optimizers.Adam(learning_rate_dict[0], epsilon=1e-4)
@@ -142,7 +145,6 @@ RatedMnistTest = utils.bernoullisample(RatedMnistTest)
 RatedFashionTest = utils.bernoullisample(RatedFashionTest)
 #omnistTestingSet = utils.bernoullisample(omnistTestingSet)
 
-CaltechTraining,CaltechTesting = Load_Caltech101(True)
 
 taskCount = 2
 
@@ -177,15 +179,9 @@ for taskIndex in range(taskCount):
         currentX = mnistTrain
 
     if taskIndex != 0:
-        arr = []
         myCount = int(np.shape(currentX)[0]/batch_size)
-        for i in range(myCount):
-            z = pz.sample([batch_size, n_latent[-1]])
-            generatedImages = baseVAEModel.generate_samples(z)
-            for j in range(batch_size):
-                arr.append(generatedImages[j])
-        arr = np.array(arr)
-        currentX = np.concatenate((currentX,arr),axis=0)
+        arr = baseVAEModel.generate_replay(myCount * batch_size, dtype=np.float32)
+        currentX = np.concatenate((normalize_batch(currentX),arr),axis=0)
     epochs = 500
     for epoch in range(epochs):
 
@@ -2,6 +2,7 @@ import numpy as np
 import tensorflow as tf
 import os
 import gzip
+import hashlib
 import cv2
 import keras as keras
 import os
@@ -9,30 +10,53 @@ import scipy.io as scio
 from Utils2 import *
 #from scipy.misc import imsave as ims
 
-def Give_InverseDataset(name):
-    data_X, data_y = load_mnist(name)
-    data_X = np.reshape(data_X, (-1, 28, 28))
-    for i in range(np.shape(data_X)[0]):
-        for k1 in range(28):
-            for k2 in range(28):
-                data_X[i, k1, k2] = 1.0 - data_X[i, k1, k2]
-
-    data_X = np.reshape(data_X,(-1,28*28))
-    return data_X
+# ---- set by parallel_runs for its worker processes: loaded, normalized and split datasets
+# are then published once as read-only .npy files and every process memory-maps them,
+# so N workers share one copy of the data through the page cache
+SHARED_DATA = os.environ.get("DEGM_SHARED_DATA", "0") == "1"
 
-def GiveLifelongTasks_AcrossDomain():
-    (train_images_nonbinary, y_train), (test_images_nonbinary, y_test) = tf.keras.datasets.mnist.load_data()
 
-    train_images_nonbinary = train_images_nonbinary.reshape(train_images_nonbinary.shape[0], 28 * 28)
-    test_images_nonbinary = test_images_nonbinary.reshape(test_images_nonbinary.shape[0], 28 * 28)
+def _save_atomic(path, data):
+    # ---- the temporary name is unique per process, concurrent writers of the same entry
+    # both finish and the last rename wins with identical content
+    tmp = "{0}.{1}.tmp.npy".format(path, os.getpid())
+    np.save(tmp, data)
+    os.replace(tmp, path)
 
-    '''
-    y_train = tf.cast(y_train, tf.int64)
-    y_test = tf.cast(y_test, tf.int64)
-    '''
+def Give_InverseDataset(name):
+    # ---- uint8 [N, 784] inverted images, memory-mapped; normalize_batch a slice where it is used
+    data_X, data_y = load_mnist_uint8(name)
+    return derivedStore.get(np.reshape(data_X,(-1,28*28)), "inverse")
+
+def Give_KerasDataset(name, normalize=True):
+    # ---- keras.datasets.<name> as flattened [N, 784] float64 images in [0, 1], or the
+    # uint8 pixels without normalize; shared between processes in SHARED_DATA mode
+    def load():
+        (Xtrain, ytrain), (Xtest, ytest) = getattr(tf.keras.datasets, name).load_data()
+        Xtrain = Xtrain.reshape(np.shape(Xtrain)[0], -1)
+        Xtest = Xtest.reshape(np.shape(Xtest)[0], -1)
+        if normalize == True:
+            return (Xtrain / 255, ytrain), (Xtest / 255, ytest)
+        return (Xtrain, ytrain), (Xtest, ytest)
+
+    if SHARED_DATA == False:
+        return load()
+    key = derivedStore.source_key("keras", name, normalize)
+    loaded = []
+
+    def part(i):
+        if len(loaded) == 0:
+            loaded.append(load())
+        return np.asarray(loaded[0][i // 2][i % 2])
+
+    parts = [derivedStore.cached("{0}_{1}".format(name, partName), key, lambda i=i: part(i))
+             for i, partName in enumerate(["xtrain", "ytrain", "xtest", "ytest"])]
+    return (parts[0], parts[1]), (parts[2], parts[3])
 
-    train_images = train_images_nonbinary / 255.
-    test_images = test_images_nonbinary / 255.
+def GiveLifelongTasks_AcrossDomain():
+    # ---- every set is returned as uint8 [N, 784] pixels (memory maps where they are cached),
+    # normalize_batch or utils.bernoullisample turn a batch or slice into [0, 1] floats where it is used
+    (train_images, y_train), (test_images, y_test) = Give_KerasDataset("mnist", normalize=False)
 
     '''
     # Binarization
@@ -46,7 +70,7 @@ def GiveLifelongTasks_AcrossDomain():
     mnistTest = test_images
 
     mnistName = "Fashion"
-    data_X, data_y = load_mnist(mnistName)
+    data_X, data_y = load_mnist_uint8(mnistName)
 
     data_X = np.reshape(data_X,(-1,28*28))
 
@@ -80,8 +104,19 @@ def GiveLifelongTasks_AcrossDomain():
 
     return mnistTrain,mnistTest,fashionTrain,fashionTest,imnistTrainX,imnistTestX,ifashionTrainX,ifashionTestX
 
+def _shared_mat(loader, dataFile, isBinarized):
+    # ---- the (training, testing) pair of a .mat loader, published once in SHARED_DATA mode
+    if SHARED_DATA == False:
+        return loader(dataFile, isBinarized)
+    key = derivedStore.source_key(dataFile, os.path.getmtime(dataFile), isBinarized)
+    name = os.path.splitext(os.path.basename(dataFile))[0]
+    return tuple(derivedStore.cached("{0}_{1}".format(name, i), key, lambda i=i: loader(dataFile, isBinarized)[i])
+                 for i in range(2))
+
 def Load_Caltech101(isBinarized):
-    dataFile = 'data/caltech101_silhouettes_28_split1.mat'
+    return _shared_mat(_load_caltech101, 'data/caltech101_silhouettes_28_split1.mat', isBinarized)
+
+def _load_caltech101(dataFile, isBinarized):
     data = scio.loadmat(dataFile)
     bc = 0
 
@@ -93,6 +128,9 @@ def Load_Caltech101(isBinarized):
 def Load_OMNIST(isBinarized):
     dataFile = 'data/omniglot.mat'
     dataFile = 'data/chardata.mat'
+    return _shared_mat(_load_omnist, dataFile, isBinarized)
+
+def _load_omnist(dataFile, isBinarized):
     data = scio.loadmat(dataFile)
 
     myData = data["data"]
@@ -108,92 +146,223 @@ def Load_OMNIST(isBinarized):
 
     return trainingSet,testingSet
 
-def load_mnist(dataset_name):
+def _extract_idx(filename, num_data, head_size, data_size):
+    with gzip.open(filename) as bytestream:
+        bytestream.read(head_size)
+        buf = bytestream.read(data_size * num_data)
+        data = np.frombuffer(buf, dtype=np.uint8)
+    return data
+
+
+def load_mnist_uint8(dataset_name):
+    # ---- the 70000 images as uint8 [N, 28, 28, 1] and the labels as uint8 [N], both
+    # already in the fixed seed-547 order. The first call converts the IDX/gzip files
+    # into .npy files next to them; later calls memory-map those read-only.
     data_dir = os.path.join("./data", dataset_name)
+    xPath = os.path.join(data_dir, "images_uint8.npy")
+    yPath = os.path.join(data_dir, "labels_uint8.npy")
 
-    def extract_data(filename, num_data, head_size, data_size):
-        with gzip.open(filename) as bytestream:
-            bytestream.read(head_size)
-            buf = bytestream.read(data_size * num_data)
-            data = np.frombuffer(buf, dtype=np.uint8).astype(np.float)
-        return data
+    if os.path.exists(xPath) and os.path.exists(yPath):
+        return np.load(xPath, mmap_mode='r'), np.load(yPath, mmap_mode='r')
 
-    data = extract_data(data_dir + '/train-images-idx3-ubyte.gz', 60000, 16, 28 * 28)
-    trX = data.reshape((60000, 28, 28, 1))
+    trX = _extract_idx(data_dir + '/train-images-idx3-ubyte.gz', 60000, 16, 28 * 28).reshape((60000, 28, 28, 1))
+    trY = _extract_idx(data_dir + '/train-labels-idx1-ubyte.gz', 60000, 8, 1).reshape((60000))
+    teX = _extract_idx(data_dir + '/t10k-images-idx3-ubyte.gz', 10000, 16, 28 * 28).reshape((10000, 28, 28, 1))
+    teY = _extract_idx(data_dir + '/t10k-labels-idx1-ubyte.gz', 10000, 8, 1).reshape((10000))
 
-    data = extract_data(data_dir + '/train-labels-idx1-ubyte.gz', 60000, 8, 1)
-    trY = data.reshape((60000))
+    X = np.concatenate((trX, teX), axis=0)
+    y = np.concatenate((trY, teY), axis=0)
 
-    data = extract_data(data_dir + '/t10k-images-idx3-ubyte.gz', 10000, 16, 28 * 28)
-    teX = data.reshape((10000, 28, 28, 1))
+    # ---- same permutation as the old np.random.seed(547) + shuffle, without touching the global RNG
+    seed = 547
+    np.random.RandomState(seed).shuffle(X)
+    np.random.RandomState(seed).shuffle(y)
 
-    data = extract_data(data_dir + '/t10k-labels-idx1-ubyte.gz', 10000, 8, 1)
-    teY = data.reshape((10000))
+    try:
+        for path, data in ((xPath, X), (yPath, y)):
+            _save_atomic(path, data)
+    except OSError:
+        # ---- read-only data directory, keep the converted arrays in memory
+        return X, y
+    return np.load(xPath, mmap_mode='r'), np.load(yPath, mmap_mode='r')
 
-    trY = np.asarray(trY)
-    teY = np.asarray(teY)
 
-    X = np.concatenate((trX, teX), axis=0)
-    y = np.concatenate((trY, teY), axis=0).astype(np.int)
+def normalize_batch(x):
+    # ---- uint8 pixels to float32 in [0, 1], applied per batch or per slice;
+    # data that is already in [0, 1] is only cast
+    x = np.asarray(x)
+    if x.dtype == np.uint8:
+        return x.astype(np.float32) / 255.
+    return x.astype(np.float32)
 
-    seed = 547
-    np.random.seed(seed)
-    np.random.shuffle(X)
-    np.random.seed(seed)
-    np.random.shuffle(y)
 
-    y_vec = np.zeros((len(y), 10), dtype=np.float)
-    for i, label in enumerate(y):
-        y_vec[i, y[i]] = 1.0
+def one_hot(y, num_classes=10):
+    return np.eye(num_classes, dtype=np.float32)[np.asarray(y, dtype=np.int64)]
+
+
+def load_mnist(dataset_name):
+    # ---- the uint8 images of load_mnist_uint8 and one-hot labels; normalize_batch a slice where it is used
+    X, y = load_mnist_uint8(dataset_name)
+    return X, one_hot(y)
+
+
+def array_fingerprint(x):
+    x = np.ascontiguousarray(x)
+    h = hashlib.sha1()
+    h.update(str((x.shape, x.dtype.str)).encode())
+    h.update(x.tobytes())
+    return h.hexdigest()
+
+
+# ---- vectorized transforms of a whole dataset; images are [N, H, W(, C)] or
+# flattened square images [N, H*W]
+def _as_images(x):
+    x = np.asarray(x)
+    if x.ndim == 2:
+        side = int(round(np.sqrt(np.shape(x)[1])))
+        return np.reshape(x, (-1, side, side)), np.shape(x)
+    return x, None
+
+
+def inverse_transform(x):
+    x = np.asarray(x)
+    if x.dtype == np.uint8:
+        return 255 - x
+    return 1.0 - x
+
+
+def resize_transform(x, height, width, chunk=10000):
+    images, _ = _as_images(x)
+    squeeze = images.ndim == 3
+    if squeeze:
+        images = images[..., None]
+    outArr = np.empty((np.shape(images)[0], height, width, np.shape(images)[3]), dtype=np.float32)
+    for start in range(0, np.shape(images)[0], chunk):
+        batch = tf.cast(images[start:start + chunk], tf.float32)
+        outArr[start:start + chunk] = tf.image.resize(batch, (height, width)).numpy()
+    if squeeze:
+        outArr = outArr[..., 0]
+    if np.asarray(x).dtype == np.uint8:
+        outArr = np.clip(np.round(outArr), 0, 255).astype(np.uint8)
+    return outArr
+
+
+def flip_transform(x, direction="horizontal"):
+    images, flatShape = _as_images(x)
+    images = np.flip(images, axis=2 if direction == "horizontal" else 1)
+    if flatShape is not None:
+        return np.reshape(images, flatShape)
+    return images
+
+
+def binarize_transform(x, seed=0):
+    # ---- the same Bernoulli draw as utils.bernoullisample, from a fixed seed
+    x = np.asarray(x, dtype=np.float32)
+    if np.max(x) > 1.0:
+        x = x / 255.
+    return np.random.RandomState(seed).binomial(1, x).astype(np.float32)
+
+
+DATASET_TRANSFORMS = {"normalize": normalize_batch,
+                      "inverse": inverse_transform,
+                      "resize": resize_transform,
+                      "flip": flip_transform,
+                      "binarize": binarize_transform}
+
+
+# ---- content-addressed store of derived datasets. An entry is keyed by the hash of
+# the source array, the transform name and its parameters, and kept as a .npy file
+# that later calls, runs and scripts open memory-mapped instead of recomputing.
+class DerivedDataStore():
+    def __init__(self, root="./data/derived"):
+        self.root = root
+
+    def key(self, source, transform, params):
+        h = hashlib.sha1()
+        h.update(array_fingerprint(source).encode())
+        h.update(transform.encode())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def source_key(self, *parts):
+        # ---- key of an entry that is not derived from an array, e.g. a file and its mtime
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def cached(self, name, key, compute):
+        path = os.path.join(self.root, "{0}_{1}.npy".format(name, key))
+        if os.path.exists(path):
+            return np.load(path, mmap_mode='r')
+
+        data = compute()
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            _save_atomic(path, data)
+        except OSError:
+            return data
+        return np.load(path, mmap_mode='r')
+
+    def get(self, source, transform, **params):
+        return self.cached(transform, self.key(source, transform, params),
+                           lambda: DATASET_TRANSFORMS[transform](source, **params))
+
+    def published(self, x):
+        # ---- True for a memory map of one of the store's own entries
+        return isinstance(x, np.memmap) and x.filename is not None and \
+            os.path.dirname(os.path.abspath(x.filename)) == os.path.abspath(self.root)
+
+
+derivedStore = DerivedDataStore()
+
+
+def Give_BinarizedTestSet(x, seed=0):
+    # ---- a test set binarized once with a fixed seed, identical across runs and scripts
+    return derivedStore.get(x, "binarize", seed=seed)
+
+
+# ---- the class-incremental split used by the 5-task experiments
+SPLIT_MNIST_GROUPS = ((0, 1), (2, 3), (4, 5), (6, 7), (8, 9))
+
+# ---- index arrays of every split computed so far, keyed by label fingerprint and grouping
+_split_cache = {}
+
+
+def split_indices(y, groups=SPLIT_MNIST_GROUPS):
+    # ---- y is either one-hot rows or integer labels; each group is a tuple of class ids.
+    # Rows keep their original order inside every group.
+    y = np.asarray(y)
+    groups = tuple(tuple(int(c) for c in group) for group in groups)
+    key = (array_fingerprint(y), groups)
+    if key not in _split_cache:
+        labels = np.argmax(y, axis=1) if y.ndim == 2 else y.astype(np.int64)
+        _split_cache[key] = [np.flatnonzero(np.isin(labels, group)) for group in groups]
+    return _split_cache[key]
+
+
+def split_by_classes(x, y, groups=SPLIT_MNIST_GROUPS, return_indices=False):
+    # ---- [(x_group, y_group), ...] for every group, or only the index arrays with return_indices
+    indexArr = split_indices(y, groups)
+    if return_indices == True:
+        return indexArr
+    return [(np.take(x, index, axis=0), np.take(y, index, axis=0)) for index in indexArr]
+
 
-    return X / 255., y_vec
+def shared_split(x, y, groups=SPLIT_MNIST_GROUPS):
+    # ---- split_by_classes with every part published as a read-only memory map. Only the
+    # parts of a published source are shared; any other x, e.g. a test set binarized by
+    # the run itself, is split in memory so per-run data never lands in the store
+    if derivedStore.published(x) == False:
+        return split_by_classes(x, y, groups)
+    key = derivedStore.source_key(array_fingerprint(x), array_fingerprint(y), groups)
+    indexArr = split_indices(y, groups)
+    return [(derivedStore.cached("split{0}_x".format(i), key, lambda index=index: np.take(x, index, axis=0)),
+             derivedStore.cached("split{0}_y".format(i), key, lambda index=index: np.take(y, index, axis=0)))
+            for i, index in enumerate(indexArr)]
 
 
 def Split_dataset_by5(x,y):
-    arr1 = []
-    arr2 = []
-    arr3 = []
-    arr4 = []
-    arr5 = []
-    labelArr1 = []
-    labelArr2 = []
-    labelArr3 = []
-    labelArr4 = []
-    labelArr5 = []
-
-    n = np.shape(x)[0]
-    for i in range(n):
-        data1 = x[i]
-        label1 = y[i]
-        if label1[0] == 1 or label1[1] == 1:
-            arr1.append(data1)
-            labelArr1.append(label1)
-
-        if label1[2] == 1 or label1[3] == 1:
-            arr2.append(data1)
-            labelArr2.append(label1)
-
-        if label1[4] == 1 or label1[5] == 1:
-            arr3.append(data1)
-            labelArr3.append(label1)
-
-        if label1[6] == 1 or label1[7] == 1:
-            arr4.append(data1)
-            labelArr4.append(label1)
-
-        if label1[8] == 1 or label1[9] == 1:
-            arr5.append(data1)
-            labelArr5.append(label1)
-
-    arr1 = np.array(arr1)
-    arr2 = np.array(arr2)
-    arr3 = np.array(arr3)
-    arr4 = np.array(arr4)
-    arr5 = np.array(arr5)
-
-    labelArr1 = np.array(labelArr1)
-    labelArr2 = np.array(labelArr2)
-    labelArr3 = np.array(labelArr3)
-    labelArr4 = np.array(labelArr4)
-    labelArr5 = np.array(labelArr5)
-    return arr1,labelArr1,arr2,labelArr2,arr3,labelArr3,arr4,labelArr4,arr5,labelArr5
+    result = []
+    parts = shared_split(x, y) if SHARED_DATA == True else split_by_classes(x, y, SPLIT_MNIST_GROUPS)
+    for data, labels in parts:
+        result.append(data)
+        result.append(labels)
+    return tuple(result)
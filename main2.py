@@ -11,6 +11,7 @@ sys.path.insert(0, './src')
 import utils
 import iwae1
 import iwae2
+import evaluation
 
 # TODO: control warm-up from commandline
 parser = argparse.ArgumentParser()
@@ -21,6 +22,8 @@ parser.add_argument("--epochs", type=int, default=-1,
                     help="numper of epochs, if set to -1 number of epochs "
                          "will be set based on the learning rate scheme from the paper")
 parser.add_argument("--objective", type=str, default="iwae_elbo", choices=["vae_elbo", "iwae_elbo", "iwae_eq14", "vae_elbo_kl"])
+parser.add_argument("--eval_batch_size", type=int, default=20, help="test examples scored per compiled call")
+parser.add_argument("--eval_sample_chunk", type=int, default=1000, help="importance samples drawn per compiled call")
 parser.add_argument("--gpu", type=str, default='7', help="Choose GPU")
 args = parser.parse_args()
 print(args)
@@ -168,17 +171,10 @@ model.save_weights('/tmp/iwae/{0}/final_weights'.format(string))
 # model.load_weights('/tmp/iwae/{0}/final_weights'.format(string))
 
 # ---- test-set llh estimate using 5000 samples
-test_elbo_metric = utils.MyMetric()
 L = 5000
 
-# ---- since we are using 5000 importance samples we have to loop over each element of the test-set
-for i, x in enumerate(Xtest):
-    res = model(x[None, :].astype(np.float32), L)
-    test_elbo_metric.update_state(res['iwae_elbo'][None, None])
-    if i % 200 == 0:
-        print("{0}/{1}".format(i, Ntest))
-
-test_set_llh = test_elbo_metric.result()
-test_elbo_metric.reset_states()
+# ---- score eval_batch_size test examples x eval_sample_chunk importance samples per compiled call
+evaluator = evaluation.TestSetEvaluator(model, L, args.eval_batch_size, args.eval_sample_chunk)
+test_set_llh = evaluator.evaluate(Xtest)
 
 print("Test-set {0} sample log likelihood estimate: {1:.4f}".format(L, test_set_llh))
@@ -0,0 +1,98 @@
+import tensorflow as tf
+import numpy as np
+import argparse
+import csv
+import gc
+import json
+import runpy
+import sys
+import time
+import traceback
+sys.path.insert(0, './src')
+import dataset_cache
+
+# ---- runs a list of experiment scripts one after another in this process, so TF/TFP
+# are imported once and every dataset is loaded once. The config is a JSON list of
+# {"script": "FiveRun_ELBO_MNIST.py", "args": {"--n_samples": 5}, "name": "elbo_mnist"};
+# "args" may also be a list of command line tokens, "name" defaults to the script.
+parser = argparse.ArgumentParser()
+parser.add_argument("--config", type=str, required=True, help="JSON list of experiment specs")
+parser.add_argument("--results", type=str, default="experiment_results.csv", help="CSV table of per-experiment timings and results")
+parser.add_argument("--stop_on_error", action="store_true", help="stop at the first failing experiment")
+args = parser.parse_args()
+print(args)
+
+with open(args.config) as f:
+    specs = json.load(f)
+
+
+def spec_argv(spec):
+    specArgs = spec.get("args", [])
+    if isinstance(specArgs, dict):
+        argv = []
+        for key, value in specArgs.items():
+            if value is True:
+                argv.append(key)
+            elif value is not False and value is not None:
+                argv.extend([key, str(value)])
+        return argv
+    return [str(a) for a in specArgs]
+
+
+def script_result(scriptGlobals):
+    # ---- FiveRun scripts leave resultsArr, the single-run DMix scripts their average in sum
+    if "resultsArr" in scriptGlobals and len(scriptGlobals["resultsArr"]) > 0:
+        values = np.asarray(scriptGlobals["resultsArr"], dtype=np.float64)
+        return np.mean(values), np.std(values)
+    value = scriptGlobals.get("sum")
+    if isinstance(value, (int, float, np.number, np.ndarray, tf.Tensor)):
+        return float(np.asarray(value)), 0.
+    return None, None
+
+
+# ---- module-level compiled functions (scoring, replay, input pipeline) and imported
+# model modules stay loaded across experiments; per-model train steps are retraced for
+# every new model, their variables are not shared
+cache = dataset_cache.DatasetCache()
+fields = ["name", "script", "status", "seconds", "data_seconds", "cache_hits", "mean", "std"]
+rows = []
+scriptArgv = sys.argv
+with cache.installed():
+    for spec in specs:
+        name = spec.get("name", spec["script"])
+        print("==== {0}".format(name))
+        sys.argv = [spec["script"]] + spec_argv(spec)
+        loadTime = cache.loadTime
+        hits = cache.hits
+        start = time.time()
+        status = "ok"
+        mean, std = None, None
+        try:
+            scriptGlobals = runpy.run_path(spec["script"], run_name="__main__")
+            mean, std = script_result(scriptGlobals)
+            del scriptGlobals
+        except (Exception, SystemExit) as e:
+            traceback.print_exc()
+            status = "failed: {0}".format(repr(e))
+            if args.stop_on_error:
+                break
+        finally:
+            rows.append({"name": name, "script": spec["script"], "status": status,
+                         "seconds": "{0:.1f}".format(time.time() - start),
+                         "data_seconds": "{0:.1f}".format(cache.loadTime - loadTime),
+                         "cache_hits": cache.hits - hits,
+                         "mean": "" if mean is None else "{0:.4f}".format(mean),
+                         "std": "" if std is None else "{0:.4f}".format(std)})
+            tf.keras.backend.clear_session()
+            gc.collect()
+
+            # ---- rewritten after every experiment, a crash keeps the finished rows
+            with open(args.results, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(rows)
+sys.argv = scriptArgv
+
+for row in rows:
+    print("{0:40s} {1:10s} {2:>8s}s data {3:>6s}s {4:>10s} {5:>8s}".format(
+        row["name"], row["status"][:10], row["seconds"], row["data_seconds"], row["mean"], row["std"]))
@@ -7,6 +7,8 @@ matplotlib.use('Agg')  # needed when running from commandline
 import matplotlib.pyplot as plt
 import cycler
 import utils
+import scoring
+import score_cache
 import tensorflow.compat.v1 as tf1
 
 
@@ -24,7 +26,7 @@ plt.rcParams['axes.prop_cycle'] = cycler.cycler('color', color)
 
 class VAENode(tf.keras.Model):
     def __init__(self,
-                 n_hidden,isBasic,
+                 n_hidden,isBasic,bias_initializer=None,
                  **kwargs):
         super(VAENode, self).__init__(**kwargs)
 
@@ -32,9 +34,12 @@ class VAENode(tf.keras.Model):
         n_latent = 100
         n_hidden = 200
         self.logLikelihood = 0
+        self.runningLogLikelihood = 0
+        self.logLikelihoodCount = 0
         self.IsBasic = isBasic
 
         self.CurrentModel = 0
+        self.sample_chunk = 500
 
         #encoder layers
         if isBasic == True:
@@ -47,7 +52,9 @@ class VAENode(tf.keras.Model):
         if isBasic == True:
             self.SharedDecoder = tf.keras.layers.Dense(n_hidden, activation=tf.nn.tanh)
         self.SpecificDecoder_layer1 = tf.keras.layers.Dense(n_hidden, activation=tf.nn.tanh)
-        self.SpecificDecoder_output = tf.keras.layers.Dense(784, activation=None,bias_initializer=utils.get_bias())
+        if bias_initializer is None:
+            bias_initializer = utils.get_bias()
+        self.SpecificDecoder_output = tf.keras.layers.Dense(784, activation=None,bias_initializer=bias_initializer)
 
         self.ComponentWeights = []
         self.BasicNodes = []
@@ -58,6 +65,19 @@ class VAENode(tf.keras.Model):
         else:
             self.ModelParameters = self.specificEncoder_net.trainable_variables + self.specificEncoder_mu.trainable_variables + self.specificEncoder_std.trainable_variables + self.SpecificDecoder_layer1.trainable_variables + self.SpecificDecoder_output.trainable_variables
 
+    def Update_LogLikelihood(self,value):
+        #last training batch's bound and a running average of it over the node's training,
+        #both kept as tensors so a training step does not wait for the device
+        self.logLikelihood = value
+        self.logLikelihoodCount = self.logLikelihoodCount + 1
+        rate = max(1.0 / self.logLikelihoodCount, 0.01)
+        self.runningLogLikelihood = self.runningLogLikelihood + rate * (value - self.runningLogLikelihood)
+
+    def Give_ReferenceLikelihood(self):
+        if self.logLikelihoodCount == 0:
+            return float(self.logLikelihood)
+        return float(self.runningLogLikelihood)
+
     def SetTrainable(self,isTrainable):
         if self.IsBasic == True:
             self.SharedEncoder.trainable = isTrainable
@@ -72,8 +92,16 @@ class VAENode(tf.keras.Model):
         self.SpecificDecoder_output.trainable = isTrainable
 
 
+    def Give_LogLikelihood(self, x, n_samples, beta=1.0):
+        # ---- per-example bound, the importance samples are drawn sample_chunk at a time
+        return utils.chunked_logmeanexp(lambda n: self.Give_LogWeights(x, n, beta), n_samples, self.sample_chunk)
+
     def call(self, x, n_samples, beta=1.0):
-        bound = 0
+        bound = tf.reduce_mean(self.Give_LogLikelihood(x, n_samples, beta), axis=-1)
+        return bound
+
+    def Give_LogWeights(self, x, n_samples, beta=1.0):
+        log_w = 0
         if self.IsBasic == True:
             output = self.SharedEncoder(x)
             output = self.specificEncoder_net(output)
@@ -98,8 +126,6 @@ class VAENode(tf.keras.Model):
             lpxz = tf.reduce_sum(pxz.log_prob(x), axis=-1)
 
             log_w = lpxz + beta * (lpz - lqzx)
-            iwae_elbo = tf.reduce_mean(utils.logmeanexp(log_w, axis=0), axis=-1)
-            bound = iwae_elbo
         else:
             z_sum = 0
             kl_sum = 0
@@ -133,10 +159,8 @@ class VAENode(tf.keras.Model):
             pxz = tfd.Bernoulli(logits=logits)
             lpxz = tf.reduce_sum(pxz.log_prob(x), axis=-1)
             log_w = lpxz + beta * kl_sum
-            iwae_elbo = tf.reduce_mean(utils.logmeanexp(log_w, axis=0), axis=-1)
-            bound = iwae_elbo
 
-        return bound
+        return log_w
 
     def Build_NormalNode(self,x,basicNodes,basicCount,weights,n_samples):
 
@@ -231,6 +255,10 @@ class CNDPM_Unsupervised_Weighted(tf.keras.Model):
         self.currentIndex = 0
 
         self.ShownWeights = np.zeros((6,6))
+        self.scoreCache = score_cache.NodeScoreCache()
+
+        #decoder output bias of new nodes, None uses the memoized MNIST bias
+        self.biasInitializer = None
 
         #self.encoder = Encoder(n_hidden, n_latent)
         #self.decoder = Decoder(n_hidden)
@@ -259,7 +287,7 @@ class CNDPM_Unsupervised_Weighted(tf.keras.Model):
         self.currentTaskIndex = self.currentTaskIndex+1
         newModel = 0
         if isFirst == True:
-            newModel = VAENode(200,True)
+            newModel = VAENode(200, True, bias_initializer=self.biasInitializer)
             newModel.Build_BasicNode(x,self.n_samples)
             self.AllNodeArr.append(newModel)
             self.currentNode = newModel
@@ -272,7 +300,7 @@ class CNDPM_Unsupervised_Weighted(tf.keras.Model):
             print("build a component")
 
             # calculate normal node
-            newModel = VAENode(200, False)
+            newModel = VAENode(200, False, bias_initializer=self.biasInitializer)
             newModel.Build_NormalNode(x, self.BasicNodeArr, self.basic_number, 0, self.n_samples)
             newModel.BasicNodes = self.BasicNodeArr
             self.AllNodeArr.append(newModel)
@@ -281,13 +309,9 @@ class CNDPM_Unsupervised_Weighted(tf.keras.Model):
         return newModel
     def Calculate_NLL_By_SelectedComponent(self,component,n_samples,textX):
         node = self.AllNodeArr[component]
-        count = int(np.shape(textX)[0]/self.batch_size)
-        sumLoss = 0
-        for i in range(count):
-            xx = textX[i*self.batch_size:(i+1)*self.batch_size]
-            loss = node(xx,n_samples)
-            sumLoss = sumLoss+loss
-        sumLoss = sumLoss / count
+        #frozen nodes are scored once per test split, later calls read the cache
+        sumLoss = self.scoreCache.score(node, textX, n_samples,
+                                        lambda: scoring.score_dataset(node, textX, n_samples, self.batch_size)[0])
         sumLoss = np.abs(sumLoss)
         return sumLoss
 
@@ -308,6 +332,14 @@ class CNDPM_Unsupervised_Weighted(tf.keras.Model):
         minIndex = minIndex+1
         return minIndex,minvalue
 
+    def Evaluation_Matrix(self,testArr,n_samples):
+        #NLL of every node on every test split, rows are nodes and columns are splits
+        matrix = np.zeros((np.shape(self.AllNodeArr)[0],len(testArr)))
+        for i in range(np.shape(self.AllNodeArr)[0]):
+            for j in range(len(testArr)):
+                matrix[i,j] = self.Calculate_NLL_By_SelectedComponent(i,n_samples,testArr[j])
+        return matrix
+
     def call(self, x, n_samples, beta=1.0):
         # ---- encode/decode
         z, qzx  = self.encoder(x, n_samples)
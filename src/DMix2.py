@@ -7,6 +7,10 @@ matplotlib.use('Agg')  # needed when running from commandline
 import matplotlib.pyplot as plt
 import cycler
 import utils
+import scoring
+import stacked_nodes
+import score_cache
+import novelty
 import tensorflow.compat.v1 as tf1
 
 
@@ -24,7 +28,7 @@ plt.rcParams['axes.prop_cycle'] = cycler.cycler('color', color)
 
 class VAENode(tf.keras.Model):
     def __init__(self,
-                 n_hidden,isBasic,
+                 n_hidden,isBasic,bias_initializer=None,
                  **kwargs):
         super(VAENode, self).__init__(**kwargs)
 
@@ -32,9 +36,13 @@ class VAENode(tf.keras.Model):
         n_latent = 100
         n_hidden = 200
         self.logLikelihood = 0
+        self.runningLogLikelihood = 0
+        self.logLikelihoodCount = 0
         self.IsBasic = isBasic
 
         self.CurrentModel = 0
+        self.sample_chunk = 500
+        self.stackedBasicNodes = stacked_nodes.StackedBasicNodes()
 
         #encoder layers
         if isBasic == True:
@@ -47,7 +55,9 @@ class VAENode(tf.keras.Model):
         if isBasic == True:
             self.SharedDecoder = tf.keras.layers.Dense(n_hidden, activation=tf.nn.tanh)
         self.SpecificDecoder_layer1 = tf.keras.layers.Dense(n_hidden, activation=tf.nn.tanh)
-        self.SpecificDecoder_output = tf.keras.layers.Dense(784, activation=None,bias_initializer=utils.get_bias())
+        if bias_initializer is None:
+            bias_initializer = utils.get_bias()
+        self.SpecificDecoder_output = tf.keras.layers.Dense(784, activation=None,bias_initializer=bias_initializer)
 
         self.ComponentWeights = []
         self.BasicNodes = []
@@ -58,6 +68,19 @@ class VAENode(tf.keras.Model):
         else:
             self.ModelParameters = self.specificEncoder_net.trainable_variables + self.specificEncoder_mu.trainable_variables + self.specificEncoder_std.trainable_variables + self.SpecificDecoder_layer1.trainable_variables + self.SpecificDecoder_output.trainable_variables
 
+    def Update_LogLikelihood(self,value):
+        #last training batch's bound and a running average of it over the node's training,
+        #both kept as tensors so a training step does not wait for the device
+        self.logLikelihood = value
+        self.logLikelihoodCount = self.logLikelihoodCount + 1
+        rate = max(1.0 / self.logLikelihoodCount, 0.01)
+        self.runningLogLikelihood = self.runningLogLikelihood + rate * (value - self.runningLogLikelihood)
+
+    def Give_ReferenceLikelihood(self):
+        if self.logLikelihoodCount == 0:
+            return float(self.logLikelihood)
+        return float(self.runningLogLikelihood)
+
     def SetTrainable(self,isTrainable):
         if self.IsBasic == True:
             self.SharedEncoder.trainable = isTrainable
@@ -72,8 +95,16 @@ class VAENode(tf.keras.Model):
         self.SpecificDecoder_output.trainable = isTrainable
 
 
+    def Give_LogLikelihood(self, x, n_samples, beta=1.0):
+        # ---- per-example bound, the importance samples are drawn sample_chunk at a time
+        return utils.chunked_mean(lambda n: self.Give_LogWeights(x, n, beta), n_samples, self.sample_chunk)
+
     def call(self, x, n_samples, beta=1.0):
-        bound = 0
+        bound = tf.reduce_mean(self.Give_LogLikelihood(x, n_samples, beta), axis=-1)
+        return bound
+
+    def Give_LogWeights(self, x, n_samples, beta=1.0):
+        log_w = 0
         if self.IsBasic == True:
             output = self.SharedEncoder(x)
             output = self.specificEncoder_net(output)
@@ -98,36 +129,11 @@ class VAENode(tf.keras.Model):
             lpxz = tf.reduce_sum(pxz.log_prob(x), axis=-1)
 
             log_w = lpxz + beta * (lpz - lqzx)
-            iwae_elbo = tf.reduce_mean(tf.reduce_mean(log_w, axis=0), axis=-1)
-            bound = iwae_elbo
         else:
-            z_sum = 0
-            kl_sum = 0
-            pz = tfd.Normal(0, 1)
-
             basicCount = self.basicCount
-            # encoding
-            for i in range(basicCount):
-                basicNode = self.BasicNodes[i]
-                output = basicNode.SharedEncoder(x)
-                output = basicNode.specificEncoder_net(output)
-                q_mu = basicNode.specificEncoder_mu(output)
-                q_std = basicNode.specificEncoder_std(output)
-                qzx = tfd.Normal(q_mu, q_std + 1e-6)
-                z = qzx.sample(n_samples)
-                z_sum = z_sum + z * self.ComponentWeights[i]
-
-                lpz = tf.reduce_sum(pz.log_prob(z), axis=-1)
-                lqzx = tf.reduce_sum(qzx.log_prob(z), axis=-1)
-                kl = (lpz - lqzx)
-                kl_sum = kl_sum + self.ComponentWeights[i] * kl
-
-            # decoding
-            sumX = 0
-            for i in range(basicCount):
-                basicNode = self.BasicNodes[i]
-                decoderOutput = basicNode.SharedDecoder(z_sum)
-                sumX = sumX + decoderOutput * self.ComponentWeights[i]
+            # encoding and decoding through all basic nodes as one batched matmul
+            z_sum, kl_sum = self.stackedBasicNodes.encode(x, self.BasicNodes, basicCount, self.ComponentWeights, n_samples)
+            sumX = self.stackedBasicNodes.decode(z_sum, self.BasicNodes, basicCount, self.ComponentWeights)
 
             reco = self.SpecificDecoder_layer1(sumX)
             logits = self.SpecificDecoder_output(reco)
@@ -136,41 +142,14 @@ class VAENode(tf.keras.Model):
             pxz = tfd.Bernoulli(logits=logits)
             lpxz = tf.reduce_sum(pxz.log_prob(x), axis=-1)
             log_w = lpxz + beta * kl_sum
-            iwae_elbo = tf.reduce_mean(tf.reduce_mean(log_w, axis=0), axis=-1)
-            bound = iwae_elbo
 
-        return bound
+        return log_w
 
     def Build_NormalNode(self,x,basicNodes,basicCount,weights,n_samples):
 
-        z_sum = 0
-        #encoding
-        z_sum = 0
-        kl_sum = 0
-        pz = tfd.Normal(0, 1)
-
-        #encoding
-        for i in range(basicCount):
-            basicNode = basicNodes[i]
-            output = basicNode.SharedEncoder(x)
-            output = basicNode.specificEncoder_net(output)
-            q_mu = basicNode.specificEncoder_mu(output)
-            q_std = basicNode.specificEncoder_std(output)
-            qzx = tfd.Normal(q_mu, q_std + 1e-6)
-            z = qzx.sample(n_samples)
-            z_sum = z_sum + z*weights[i]
-
-            lpz = tf.reduce_sum(pz.log_prob(z), axis=-1)
-            lqzx = tf.reduce_sum(qzx.log_prob(z), axis=-1)
-            kl = (lpz - lqzx)
-            kl_sum = kl_sum + weights[i]*kl
-
-        #decoding
-        sumX = 0
-        for i in range(basicCount):
-            basicNode = basicNodes[i]
-            decoderOutput = basicNode.SharedDecoder(z_sum)
-            sumX = sumX + decoderOutput*weights[i]
+        #encoding and decoding through all basic nodes as one batched matmul
+        z_sum, kl_sum = self.stackedBasicNodes.encode(x,basicNodes,basicCount,weights,n_samples)
+        sumX = self.stackedBasicNodes.decode(z_sum,basicNodes,basicCount,weights)
 
         reco = self.SpecificDecoder_layer1(sumX)
         logits = self.SpecificDecoder_output(reco)
@@ -233,6 +212,19 @@ class DMix(tf.keras.Model):
         self.currentIndex = 0
 
         self.ShownWeights = np.zeros((6,6))
+        self.scoreCache = score_cache.NodeScoreCache()
+
+        #decoder output bias of new nodes, None uses the memoized MNIST bias
+        self.biasInitializer = None
+
+        #novelty test in Create_New_Component, "two_stage" or "full"; two_stage is only
+        #cheaper when it expands, see novelty.two_stage_scores
+        self.noveltyMode = "full"
+        self.noveltySubsample = 200
+        self.noveltyTopK = 2
+        self.noveltyWorkers = 1
+        self.noveltyReport = False
+        self.noveltyStats = []
 
         #self.encoder = Encoder(n_hidden, n_latent)
         #self.decoder = Decoder(n_hidden)
@@ -260,29 +252,16 @@ class DMix(tf.keras.Model):
         #The first task learning
         newModel = 0
         if isFirst == True:
-            newModel = VAENode(200,True)
+            newModel = VAENode(200, True, bias_initializer=self.biasInitializer)
             newModel.Build_BasicNode(x,self.n_samples)
             self.AllNodeArr.append(newModel)
             self.currentNode = newModel
             self.BasicNodeArr.append(newModel)
         else:
             #Evaluate Similarity matrix
-            arr = []
+            arr = novelty.novelty_scores(self, data)
             weights = []
-            sumWeight =0
-            count = int(np.shape(data)[0]/self.batch_size)
-            for i in range(self.basic_number):
-                basicNode = self.BasicNodeArr[i]
-                lossSum = 0
-                for j in range(count):
-                    x1 = data[j*self.batch_size:(j+1)*self.batch_size]
-                    loss = basicNode(x1,self.n_samples)
-                    lossSum = lossSum+loss
-                lossSum = lossSum / count
-
-                diff = np.abs(lossSum - basicNode.logLikelihood)
-                arr.append(diff)
-                sumWeight = sumWeight+diff
+            sumWeight = np.sum(arr)
 
             isExpansion= False
             minum = np.min(arr)
@@ -293,7 +272,7 @@ class DMix(tf.keras.Model):
 
             if isExpansion == True:
                 print("build basic")
-                newModel = VAENode(200, True)
+                newModel = VAENode(200, True, bias_initializer=self.biasInitializer)
                 newModel.Build_BasicNode(x, self.n_samples)
                 self.AllNodeArr.append(newModel)
                 self.currentNode = newModel
@@ -311,7 +290,7 @@ class DMix(tf.keras.Model):
                 self.Componentweights = weights
 
                 #calculate normal node
-                newModel = VAENode(200, False)
+                newModel = VAENode(200, False, bias_initializer=self.biasInitializer)
                 newModel.Build_NormalNode(x,self.BasicNodeArr,self.basic_number,weights,self.n_samples)
                 newModel.ComponentWeights = self.Componentweights.copy()
                 newModel.BasicNodes = self.BasicNodeArr
@@ -322,13 +301,9 @@ class DMix(tf.keras.Model):
         return newModel
     def Calculate_NLL_By_SelectedComponent(self,component,n_samples,textX):
         node = self.AllNodeArr[component]
-        count = int(np.shape(textX)[0]/self.batch_size)
-        sumLoss = 0
-        for i in range(count):
-            xx = textX[i*self.batch_size:(i+1)*self.batch_size]
-            loss = node(xx,n_samples)
-            sumLoss = sumLoss+loss
-        sumLoss = sumLoss / count
+        #frozen nodes are scored once per test split, later calls read the cache
+        sumLoss = self.scoreCache.score(node, textX, n_samples,
+                                        lambda: scoring.score_dataset(node, textX, n_samples, self.batch_size)[0])
         sumLoss = np.abs(sumLoss)
         return sumLoss
 
@@ -349,6 +324,14 @@ class DMix(tf.keras.Model):
         minIndex = minIndex+1
         return minIndex,minvalue
 
+    def Evaluation_Matrix(self,testArr,n_samples):
+        #NLL of every node on every test split, rows are nodes and columns are splits
+        matrix = np.zeros((np.shape(self.AllNodeArr)[0],len(testArr)))
+        for i in range(np.shape(self.AllNodeArr)[0]):
+            for j in range(len(testArr)):
+                matrix[i,j] = self.Calculate_NLL_By_SelectedComponent(i,n_samples,testArr[j])
+        return matrix
+
     def call(self, x, n_samples, beta=1.0):
         # ---- encode/decode
         z, qzx  = self.encoder(x, n_samples)
@@ -0,0 +1,70 @@
+import contextlib
+import functools
+import time
+import numpy as np
+import tensorflow as tf
+
+
+# ---- dataset loaders the experiment scripts call: keras.datasets.<name>.load_data and
+# the data_hand functions below, which are imported only when the cache is installed
+KERAS_LOADERS = ["mnist", "fashion_mnist"]
+DATA_HAND_LOADERS = ["Give_KerasDataset", "load_mnist", "load_mnist_uint8", "Load_OMNIST", "Load_Caltech101",
+                     "GiveLifelongTasks_AcrossDomain", "Give_InverseDataset"]
+
+
+def _copy(value):
+    # ---- every caller gets its own arrays, scripts are free to modify what they load
+    if isinstance(value, np.ndarray):
+        return np.array(value)
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+# ---- process-wide memo of loaded datasets. install() swaps the loaders above for
+# cached versions, so a sequence of experiments run in one process reads and decodes
+# every dataset once, whichever script asks for it first.
+class DatasetCache():
+    def __init__(self):
+        self.values = {}
+        self.loadTime = 0.
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        if key not in self.values:
+            start = time.time()
+            self.values[key] = loader()
+            self.loadTime = self.loadTime + time.time() - start
+            self.misses = self.misses + 1
+        else:
+            self.hits = self.hits + 1
+        return _copy(self.values[key])
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        def cached(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            return self.get(key, lambda: fn(*args, **kwargs))
+        return cached
+
+    @contextlib.contextmanager
+    def installed(self):
+        import keras
+        import data_hand
+        patched = []
+        for dataset in KERAS_LOADERS:
+            for module in {getattr(tf.keras.datasets, dataset), getattr(keras.datasets, dataset)}:
+                patched.append((module, "load_data", module.load_data))
+        for name in DATA_HAND_LOADERS:
+            patched.append((data_hand, name, getattr(data_hand, name)))
+
+        for module, name, fn in patched:
+            setattr(module, name, self.wrap(module.__name__ + "." + name, fn))
+        try:
+            yield self
+        finally:
+            for module, name, fn in reversed(patched):
+                setattr(module, name, fn)
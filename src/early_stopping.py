@@ -0,0 +1,55 @@
+import numpy as np
+import graph_checkpoint
+import input_pipeline
+import scoring
+
+
+# ---- early stopping of a task's epoch loop on the ELBO of examples held out from the
+# task. Every `every` epochs the node being trained is scored on them; after `patience`
+# checks without an improvement of at least min_delta nats the task stops, and the node
+# gets back the weights of its best check. Only the node's own layers are saved and
+# restored, the basic nodes a specific node reads from are frozen.
+class EarlyStopping():
+    def __init__(self, patience=5, min_delta=0.1, every=5, n_samples=1, batch_size=500, seed=0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.every = every
+        self.n_samples = n_samples
+        self.batch_size = batch_size
+        self.random = np.random.RandomState(seed)
+        self.stopEpochs = []
+
+    def begin(self, node, validX):
+        # ---- the held-out examples are binarized once, so every check scores the same data
+        binarized = self.random.binomial(1, validX, size=validX.shape).astype(np.float32)
+        self.validX = input_pipeline.PackedBits(binarized)
+        self.best = float(-np.inf)
+        self.bestEpoch = -1
+        self.bestWeights = None
+        self.wait = 0
+
+    def elbo(self, node):
+        return -scoring.score_dataset(node, self.validX, self.n_samples, self.batch_size)[0]
+
+    def update(self, node, epoch):
+        # ---- called after every epoch, True when the task should stop
+        if (epoch + 1) % self.every != 0:
+            return False
+        elbo = self.elbo(node)
+        if elbo > self.best + self.min_delta:
+            self.best = elbo
+            self.bestEpoch = epoch
+            self.bestWeights = [layer.get_weights() for layer in graph_checkpoint.node_layers(node)]
+            self.wait = 0
+        else:
+            self.wait = self.wait + 1
+        print("epoch {0}, held-out ELBO: {1:.2f}, best: {2:.2f} at epoch {3}".format(epoch, elbo, self.best, self.bestEpoch))
+        return self.wait >= self.patience
+
+    def finish(self, node, taskIndex, epoch):
+        # ---- epoch is the last epoch trained
+        if self.bestWeights is not None:
+            for layer, weights in zip(graph_checkpoint.node_layers(node), self.bestWeights):
+                layer.set_weights(weights)
+        self.stopEpochs.append(epoch)
+        print("task {0} stopped after epoch {1}, best held-out ELBO {2:.2f} at epoch {3}".format(taskIndex, epoch, self.best, self.bestEpoch))
@@ -0,0 +1,45 @@
+import time
+import numpy as np
+import tensorflow as tf
+import input_pipeline
+
+
+# ---- test-set llh estimate for iwae1.IWAE, iwae1_deep.IWAE_Deep and iwae2.IWAE
+# every compiled call scores a tile of batch_size examples x sample_chunk
+# importance samples, instead of one eager call per test image
+class TestSetEvaluator():
+    def __init__(self, model, n_samples=5000, batch_size=20, sample_chunk=None):
+        self.model = model
+        self.n_samples = n_samples
+        self.batch_size = batch_size
+        if sample_chunk is None:
+            sample_chunk = n_samples
+        self.sample_chunk = min(sample_chunk, n_samples)
+        self.examples_per_sec = 0.
+
+        self._log_px = tf.function(self._tile_log_px,
+                                   input_signature=[tf.TensorSpec(shape=[None, None], dtype=tf.float32)])
+
+    def _tile_log_px(self, x):
+        # ---- eq (8) per example, streamed over chunks of sample_chunk importance samples
+        res = self.model(x, self.n_samples, sample_chunk=self.sample_chunk)
+        return res["log_px"]
+
+    def log_likelihood(self, X):
+        dataset = input_pipeline.batched_dataset(X, self.batch_size)
+
+        start = time.time()
+        values = []
+        for x_batch in dataset:
+            values.append(self._log_px(x_batch).numpy())
+        took = time.time() - start
+
+        log_px = np.concatenate(values, axis=0)
+        self.examples_per_sec = log_px.shape[0] / max(took, 1e-12)
+        return log_px
+
+    def evaluate(self, X):
+        log_px = self.log_likelihood(X)
+        print("scored {0} examples with {1} samples, {2:.1f} examples/sec"
+              .format(log_px.shape[0], self.n_samples, self.examples_per_sec))
+        return np.mean(log_px)
@@ -0,0 +1,293 @@
+import json
+import os
+import sys
+import threading
+import time
+import warnings
+import numpy as np
+import tensorflow as tf
+
+
+# ---- snapshot of a DEGM mixture (DMix and its variants): the node graph, every node's
+# own weights and the mixture's bookkeeping, in one .npz file. A specific node's
+# BasicNodes are other nodes of AllNodeArr, so they are saved once under their own index
+# and the specific node keeps only their indices.
+
+BASIC_LAYERS = ["SharedEncoder", "specificEncoder_net", "specificEncoder_mu", "specificEncoder_std",
+                "SharedDecoder", "SpecificDecoder_layer1", "SpecificDecoder_output"]
+SPECIFIC_LAYERS = ["specificEncoder_net", "specificEncoder_mu", "specificEncoder_std",
+                   "SpecificDecoder_layer1", "SpecificDecoder_output"]
+
+# ---- plain mixture attributes restored as they were saved
+GRAPH_ATTRIBUTES = ["currentTaskIndex", "basic_number", "basicIndexArr", "Componentweights",
+                    "currentIndex", "threshold", "ShownWeights"]
+
+
+def node_layers(node):
+    return [getattr(node, name) for name in (BASIC_LAYERS if node.IsBasic == True else SPECIFIC_LAYERS)]
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return {"ndarray": value.tolist()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    if isinstance(value, tf.Tensor):
+        return _to_json(value.numpy())
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, dict) and "ndarray" in value:
+        return np.array(value["ndarray"])
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    return value
+
+
+def graph_state(model):
+    # ---- (topology, arrays): a JSON-able description of the graph and a dict of weights
+    nodes = list(model.AllNodeArr)
+    index = {id(node): i for i, node in enumerate(nodes)}
+    basicArr = [index[id(node)] for node in model.BasicNodeArr]
+    arrays = {}
+    nodeArr = []
+    for i, node in enumerate(nodes):
+        weights = [w for layer in node_layers(node) for w in layer.get_weights()]
+        for j, w in enumerate(weights):
+            arrays["node{0}_{1}".format(i, j)] = w
+        nodeArr.append({"basic": bool(node.IsBasic),
+                        "trainable": bool(node.SpecificDecoder_output.trainable),
+                        "weightCount": len(weights),
+                        "basicNodes": [index[id(b)] for b in node.BasicNodes],
+                        "sharesBasicArr": node.BasicNodes is model.BasicNodeArr,
+                        "basicCount": _to_json(node.basicCount),
+                        "componentWeights": _to_json(list(node.ComponentWeights)),
+                        "logLikelihood": float(node.logLikelihood),
+                        "runningLogLikelihood": float(node.runningLogLikelihood),
+                        "logLikelihoodCount": int(node.logLikelihoodCount)})
+    topology = {"modelClass": type(model).__name__,
+                "nodes": nodeArr,
+                "basicNodes": basicArr,
+                "currentNode": index.get(id(model.currentNode), -1),
+                "attributes": {name: _to_json(getattr(model, name)) for name in GRAPH_ATTRIBUTES if hasattr(model, name)}}
+    return topology, arrays
+
+
+def _optimizer_variables(optimizer):
+    # ---- the state variables of a Keras >= 2.11 optimizer other than the step count, in
+    # the order build() creates them (Adam: m and v of every variable), or None for an
+    # optimizer without them, e.g. the pre-2.11 ones with named slots
+    if hasattr(optimizer, "get_slot_names") or not isinstance(getattr(type(optimizer), "variables", None), property):
+        return None
+    return [v for v in optimizer.variables if v is not optimizer.iterations]
+
+
+def optimizer_state(optimizer, variables):
+    # ---- the step count and the per-variable state (Adam's m and v), so training resumes
+    # mid-task where it stopped. Pre-2.11 optimizers save the named slots of the given
+    # variables, later ones every state variable they built, which is the state of the
+    # given variables as long as the optimizer was built for them
+    arrays = {"optimizer_iterations": np.asarray(optimizer.iterations.numpy())}
+    optimizerVariables = _optimizer_variables(optimizer)
+    if hasattr(optimizer, "get_slot_names"):
+        for name in optimizer.get_slot_names():
+            for i, var in enumerate(variables):
+                try:
+                    arrays["slot_{0}_{1}".format(name, i)] = optimizer.get_slot(var, name).numpy()
+                except KeyError:
+                    pass
+    elif optimizerVariables is not None:
+        for i, var in enumerate(optimizerVariables):
+            arrays["optimizer_variable_{0}".format(i)] = var.numpy()
+    else:
+        warnings.warn("{0} exposes neither slots nor variables, only its step count is checkpointed".format(
+            type(optimizer).__name__))
+    return arrays
+
+
+def restore_optimizer(optimizer, variables, arrays):
+    if "optimizer_iterations" in arrays:
+        optimizer.iterations.assign(arrays["optimizer_iterations"])
+    if hasattr(optimizer, "get_slot_names") and hasattr(optimizer, "_create_all_weights"):
+        optimizer._create_all_weights(variables)
+        for name in optimizer.get_slot_names():
+            for i, var in enumerate(variables):
+                key = "slot_{0}_{1}".format(name, i)
+                if key in arrays:
+                    optimizer.get_slot(var, name).assign(arrays[key])
+        return
+
+    saved = [arrays[key] for key in sorted((k for k in arrays if k.startswith("optimizer_variable_")),
+                                           key=lambda k: int(k[len("optimizer_variable_"):]))]
+    if len(saved) == 0:
+        return
+    if _optimizer_variables(optimizer) is None:
+        warnings.warn("the checkpoint has optimizer variables but {0} has none to restore them to".format(
+            type(optimizer).__name__))
+        return
+    optimizer.build(variables)
+    optimizerVariables = _optimizer_variables(optimizer)
+    if [tuple(v.shape) for v in optimizerVariables] != [np.shape(a) for a in saved]:
+        warnings.warn("the optimizer state in the checkpoint does not match the variables it is restored for, "
+                      "the optimizer starts from a fresh state")
+        return
+    for var, value in zip(optimizerVariables, saved):
+        var.assign(value)
+
+
+def snapshot(model, extra=None, optimizer=None):
+    # ---- everything save_graph writes, copied out of the model; the copy can be written
+    # from another thread while training goes on
+    topology, arrays = graph_state(model)
+    topology["extra"] = extra or {}
+    rngState = np.random.get_state()
+    topology["numpyRng"] = [rngState[0], int(rngState[2]), int(rngState[3]), float(rngState[4])]
+    arrays["numpy_rng_keys"] = rngState[1].copy()
+    if optimizer is not None and model.currentNode in model.AllNodeArr:
+        arrays.update(optimizer_state(optimizer, model.currentNode.trainable_variables))
+    arrays["topology"] = np.frombuffer(json.dumps(topology).encode(), dtype=np.uint8)
+    return arrays
+
+
+def write_snapshot(path, arrays):
+    # ---- the file is replaced atomically, a crash mid-write leaves the previous one
+    directory = os.path.dirname(path)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    tmp = "{0}.{1}.tmp.npz".format(path, os.getpid())
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def save_graph(model, path, extra=None, optimizer=None):
+    # ---- extra is any JSON-able dict stored next to the graph, e.g. the task index;
+    # the numpy global RNG state is saved too
+    write_snapshot(path, snapshot(model, extra, optimizer))
+
+
+def load_graph(path):
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files}
+    topology = json.loads(arrays.pop("topology").tobytes().decode())
+    return topology, arrays
+
+
+def restore_graph(model, path, restore_rng=True, optimizer=None, keep_attributes=()):
+    # ---- rebuilds model.AllNodeArr and the mixture bookkeeping on a freshly constructed
+    # mixture of the saved class; returns the extra dict given to save_graph. The mixture
+    # attributes named in keep_attributes keep the caller's values.
+    topology, arrays = load_graph(path)
+    VAENode = sys.modules[type(model).__module__].VAENode
+    dummy = tf.zeros([1, 784])
+
+    nodes = []
+    basicArr = []
+    for i, spec in enumerate(topology["nodes"]):
+        node = VAENode(200, spec["basic"], bias_initializer=model.biasInitializer)
+        if spec["basic"] == True:
+            node.Build_BasicNode(dummy, 1)
+        else:
+            if spec["sharesBasicArr"] == True:
+                basicNodes = basicArr
+            else:
+                basicNodes = [nodes[b] for b in spec["basicNodes"]]
+            weights = spec["componentWeights"]
+            node.Build_NormalNode(dummy, basicNodes, spec["basicCount"], weights, 1)
+            node.ComponentWeights = list(weights)
+            node.BasicNodes = basicNodes
+            node.basicCount = spec["basicCount"]
+
+        weights = [arrays["node{0}_{1}".format(i, j)] for j in range(spec["weightCount"])]
+        for layer in node_layers(node):
+            n = len(layer.weights)
+            layer.set_weights(weights[:n])
+            weights = weights[n:]
+        node.SetTrainable(spec["trainable"])
+        node.logLikelihood = spec["logLikelihood"]
+        node.runningLogLikelihood = spec["runningLogLikelihood"]
+        node.logLikelihoodCount = spec["logLikelihoodCount"]
+        nodes.append(node)
+        if i in topology["basicNodes"]:
+            basicArr.append(node)
+
+    model.AllNodeArr = nodes
+    model.BasicNodeArr = basicArr
+    # ---- specific nodes that shared the mixture's basic list keep sharing it
+    for node, spec in zip(nodes, topology["nodes"]):
+        if spec["basic"] == False and spec["sharesBasicArr"] == True:
+            node.BasicNodes = model.BasicNodeArr
+    model.currentNode = nodes[topology["currentNode"]] if topology["currentNode"] >= 0 else 0
+    for name, value in topology["attributes"].items():
+        if name not in keep_attributes:
+            setattr(model, name, _from_json(value))
+
+    if restore_rng == True:
+        name, pos, hasGauss, cached = topology["numpyRng"]
+        np.random.set_state((name, arrays["numpy_rng_keys"], pos, hasGauss, cached))
+    if optimizer is not None and topology["currentNode"] >= 0:
+        restore_optimizer(optimizer, model.currentNode.trainable_variables, arrays)
+    return topology["extra"]
+
+
+# ---- periodic checkpoints of a training run. A snapshot is taken on the training thread
+# every `interval` seconds and written by a background thread, so the 500-epoch loops
+# only pay for copying the weights. The position saved with it (task, epoch, batches done
+# in that epoch, step) is where a restarted run continues.
+class TrainingCheckpoint():
+    def __init__(self, path, interval=600., optimizer=None):
+        self.path = path
+        self.interval = interval
+        self.optimizer = optimizer
+        self.state = {}
+        self.lastSave = time.time()
+        self.thread = None
+
+    def restore(self, model):
+        # ---- True if the run resumes from an earlier checkpoint
+        if not os.path.exists(self.path):
+            return False
+        self.state = restore_graph(model, self.path, optimizer=self.optimizer)
+        print("resuming task {0}, epoch {1}, batch {2}".format(self.state["taskIndex"], self.state["epoch"], self.state["batch"]))
+        return True
+
+    def first_task(self):
+        if len(self.state) == 0:
+            return 0
+        return self.state["taskIndex"] + 1 if self.state["done"] == True else self.state["taskIndex"]
+
+    def resumes_task(self, taskIndex):
+        # ---- the task was interrupted, its node already exists in the restored graph
+        return len(self.state) > 0 and self.state["done"] == False and self.state["taskIndex"] == taskIndex
+
+    def position(self, taskIndex):
+        # ---- (first epoch, batches of that epoch already done)
+        if self.resumes_task(taskIndex):
+            return self.state["epoch"], self.state["batch"]
+        return 0, 0
+
+    def _write(self, arrays):
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = threading.Thread(target=write_snapshot, args=(self.path, arrays), daemon=True)
+        self.thread.start()
+        self.lastSave = time.time()
+
+    def maybe_save(self, model, taskIndex, epoch, batch, step):
+        # ---- called after every batch; skipped while the previous write is still running
+        if time.time() - self.lastSave < self.interval:
+            return
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self._write(snapshot(model, {"taskIndex": taskIndex, "epoch": epoch, "batch": batch, "step": step, "done": False},
+                             self.optimizer))
+
+    def save_task(self, model, taskIndex, step):
+        self._write(snapshot(model, {"taskIndex": taskIndex, "epoch": 0, "batch": 0, "step": step, "done": True},
+                             self.optimizer))
+
+    def close(self):
+        if self.thread is not None:
+            self.thread.join()
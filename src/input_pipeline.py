@@ -0,0 +1,150 @@
+import numpy as np
+import tensorflow as tf
+
+
+def to_uint8(X):
+    # ---- pixel intensities in [0, 1] stored as uint8, a quarter of float32
+    X = np.asarray(X)
+    if X.dtype == np.uint8:
+        return X
+    return np.round(np.clip(X, 0., 1.) * 255.).astype(np.uint8)
+
+
+def pack_bits(X):
+    # ---- binary [N, D] data as [N, ceil(D / 8)] uint8, 98 bytes for a 784-pixel image
+    return np.packbits(np.asarray(X) > 0.5, axis=1)
+
+
+def unpack_bits(packed, n_features=784):
+    return np.unpackbits(np.asarray(packed, dtype=np.uint8), axis=1, count=n_features).astype(np.float32)
+
+
+def unpack_bits_tf(packed, n_features=784):
+    # ---- the same unpacking inside a tf.data map, most significant bit first like np.packbits
+    shifts = tf.constant([7, 6, 5, 4, 3, 2, 1, 0], dtype=tf.uint8)
+    bits = tf.bitwise.bitwise_and(tf.bitwise.right_shift(packed[..., None], shifts), 1)
+    bits = tf.reshape(bits, [tf.shape(packed)[0], -1])[:, :n_features]
+    return tf.cast(bits, tf.float32)
+
+
+# ---- growable bit-packed store of binary images, for binarized test sets and replay
+# samples. Appends amortize to O(1) per row instead of re-copying with np.concatenate.
+class PackedBits():
+    def __init__(self, X=None, n_features=784):
+        self.n_features = n_features
+        self.data = np.zeros((0, (n_features + 7) // 8), dtype=np.uint8)
+        self.count = 0
+        if X is not None:
+            self.append(X)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def shape(self):
+        return (self.count, self.n_features)
+
+    @property
+    def packed(self):
+        return self.data[:self.count]
+
+    def append(self, X):
+        packed = pack_bits(X)
+        n = np.shape(packed)[0]
+        if self.count + n > np.shape(self.data)[0]:
+            capacity = max(self.count + n, 2 * np.shape(self.data)[0])
+            data = np.zeros((capacity, np.shape(self.data)[1]), dtype=np.uint8)
+            data[:self.count] = self.data[:self.count]
+            self.data = data
+        self.data[self.count:self.count + n] = packed
+        self.count = self.count + n
+
+    def unpack(self, index=None):
+        if index is None:
+            return unpack_bits(self.packed, self.n_features)
+        return unpack_bits(self.packed[index], self.n_features)
+
+    def dataset(self, batch_size):
+        n_features = self.n_features
+        return (tf.data.Dataset.from_tensor_slices(self.packed)
+                .batch(batch_size)
+                .map(lambda packed: unpack_bits_tf(packed, n_features))
+                .prefetch(tf.data.experimental.AUTOTUNE))
+
+
+def batched_dataset(X, batch_size):
+    # ---- float32 batches of either a plain array or a PackedBits set
+    if isinstance(X, PackedBits):
+        return X.dataset(batch_size)
+    return (tf.data.Dataset.from_tensor_slices(np.asarray(X, dtype=np.float32))
+            .batch(batch_size)
+            .prefetch(tf.data.experimental.AUTOTUNE))
+
+
+# ---- training batches of one task's data. The data is kept once as uint8; every
+# epoch shuffles an index, gathers a batch and binarizes it with a stateless RNG
+# seeded by (seed, epoch, batch), so no full-array copy is made per epoch and the
+# Bernoulli draws are reproducible whatever the parallelism of the map.
+# Replay samples, if any, stay bit-packed and are unpacked per batch.
+class BinarizedStream():
+    def __init__(self, X, batch_size, seed=0, num_parallel_calls=None, drop_remainder=True, replay=None):
+        self.images = tf.constant(to_uint8(X))
+        self.n_data = int(np.shape(X)[0])
+        self.replay = None
+        self.n_examples = self.n_data
+        if replay is not None and len(replay) > 0:
+            self.replay = tf.constant(replay.packed)
+            self.n_features = replay.n_features
+            self.n_examples = self.n_data + len(replay)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.num_parallel_calls = num_parallel_calls
+        self.drop_remainder = drop_remainder
+
+    def _binarize(self, batchIndex, index, epoch):
+        probs = tf.cast(tf.gather(self.images, tf.minimum(index, self.n_data - 1)), tf.float32) / 255.
+        if self.replay is not None:
+            # ---- replay rows are already binary, a 0/1 probability reproduces them exactly
+            isReplay = index >= self.n_data
+            replayIndex = tf.maximum(index - self.n_data, 0)
+            bits = unpack_bits_tf(tf.gather(self.replay, replayIndex), self.n_features)
+            probs = tf.where(isReplay[:, None], bits, probs)
+        seed = tf.stack([tf.cast(self.seed, tf.int64) * 100003 + epoch, batchIndex])
+        u = tf.random.stateless_uniform(tf.shape(probs), seed=seed)
+        return tf.cast(u < probs, tf.float32)
+
+    def epoch(self, epoch):
+        dataset = tf.data.Dataset.range(self.n_examples)
+        dataset = dataset.shuffle(self.n_examples, seed=self.seed * 100003 + epoch, reshuffle_each_iteration=False)
+        dataset = dataset.batch(self.batch_size, drop_remainder=self.drop_remainder).enumerate()
+        dataset = dataset.map(lambda batchIndex, index: self._binarize(batchIndex, index, epoch),
+                              num_parallel_calls=self.num_parallel_calls)
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    def steps_per_epoch(self):
+        if self.drop_remainder == True:
+            return self.n_examples // self.batch_size
+        return int(np.ceil(self.n_examples / self.batch_size))
+
+
+# ---- lazy generative replay: every training batch takes (1 - replay_ratio) of its rows
+# from the task data and the rest fresh from generator(n), e.g. the replay_batch of a
+# frozen model or replay.node_generator of frozen mixture nodes. No replay set is
+# stored, so memory does not grow with the number of tasks. With ratio 0.5 an epoch
+# has as many steps as one over the task data concatenated with as many replay samples.
+class ReplayMixingStream():
+    def __init__(self, X, batch_size, generator, replay_ratio=0.5, seed=0, num_parallel_calls=None):
+        self.n_replay = int(round(batch_size * replay_ratio))
+        self.generator = generator
+        self.realStream = BinarizedStream(X, batch_size - self.n_replay, seed, num_parallel_calls)
+
+    def epoch(self, epoch):
+        for realBatch in self.realStream.epoch(epoch):
+            if self.n_replay == 0:
+                yield realBatch
+                continue
+            generated = tf.cast(self.generator(tf.constant(self.n_replay, dtype=tf.int32)), tf.float32)
+            yield tf.concat([realBatch, generated], axis=0)
+
+    def steps_per_epoch(self):
+        return self.realStream.steps_per_epoch()
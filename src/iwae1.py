@@ -7,6 +7,7 @@ matplotlib.use('Agg')  # needed when running from commandline
 import matplotlib.pyplot as plt
 import cycler
 import utils
+import replay
 
 
 # ---- plot settings
@@ -64,15 +65,19 @@ class Encoder(tf.keras.Model):
 class Decoder(tf.keras.Model):
     def __init__(self,
                  n_hidden,
+                 bias_initializer=None,
                  **kwargs):
         super(Decoder, self).__init__(**kwargs)
 
+        if bias_initializer is None:
+            bias_initializer = utils.get_bias()
+
         self.decode_z_to_x = tf.keras.Sequential(
             [
                 tf.keras.layers.Dense(n_hidden, activation=tf.nn.tanh),
                 tf.keras.layers.Dense(n_hidden, activation=tf.nn.tanh),
                 tf.keras.layers.Dense(784, activation=None,
-                                      bias_initializer=utils.get_bias())
+                                      bias_initializer=bias_initializer)
             ]
         )
 
@@ -89,11 +94,14 @@ class IWAE(tf.keras.Model):
     def __init__(self,
                  n_hidden,
                  n_latent,
+                 bias_initializer=None,
                  **kwargs):
         super(IWAE, self).__init__(**kwargs)
 
+        self.constructor_args = (n_hidden, n_latent)
+        self.n_latent = n_latent
         self.encoder = Encoder(n_hidden, n_latent)
-        self.decoder = Decoder(n_hidden)
+        self.decoder = Decoder(n_hidden, bias_initializer=bias_initializer)
 
     def GiveReconstruction(self,x,n_samples):
         z, qzx = self.encoder(x, n_samples)
@@ -106,7 +114,28 @@ class IWAE(tf.keras.Model):
         z, qzx = self.encoder(x, n_samples)
         return qzx
 
-    def call(self, x, n_samples, beta=1.0):
+    def log_weights(self, x, n_samples, beta=1.0):
+        z, qzx = self.encoder(x, n_samples)
+
+        logits, pxz = self.decoder(z)
+
+        pz = tfd.Normal(0, 1)
+
+        lpz = tf.reduce_sum(pz.log_prob(z), axis=-1)
+
+        lqzx = tf.reduce_sum(qzx.log_prob(z), axis=-1)
+
+        lpxz = tf.reduce_sum(pxz.log_prob(x), axis=-1)
+
+        return lpxz + beta * (lpz - lqzx)
+
+    def call(self, x, n_samples, beta=1.0, sample_chunk=None):
+        if sample_chunk is not None and sample_chunk < n_samples:
+            # ---- bound only, the importance samples are drawn sample_chunk at a time
+            log_px = utils.chunked_logmeanexp(lambda n: self.log_weights(x, n, beta), n_samples, sample_chunk)
+            return {"iwae_elbo": tf.reduce_mean(log_px, axis=-1),
+                    "log_px": log_px}
+
         # ---- encode/decode
         z, qzx  = self.encoder(x, n_samples)
 
@@ -133,7 +162,8 @@ class IWAE(tf.keras.Model):
 
         # ---- IWAE elbos
         # eq (8): logmeanexp over samples and mean over batch
-        iwae_elbo = tf.reduce_mean(utils.logmeanexp(log_w, axis=0), axis=-1)
+        log_px = utils.logmeanexp(log_w, axis=0)
+        iwae_elbo = tf.reduce_mean(log_px, axis=-1)
 
         # eq (14):
         m = tf.reduce_max(log_w, axis=0, keepdims=True)
@@ -156,6 +186,8 @@ class IWAE(tf.keras.Model):
                 "z": z,
                 "snis_z": snis_z,
                 "al": al,
+                "log_w": log_w,
+                "log_px": log_px,
                 "logits": logits,
                 "lpxz": lpxz,
                 "lpz": lpz,
@@ -192,6 +224,19 @@ class IWAE(tf.keras.Model):
         x_samples, x_probs = self.sample(z)
         return x_samples
 
+    @tf.function(input_signature=[tf.TensorSpec(shape=[], dtype=tf.int32)])
+    def replay_batch(self, n):
+        # ---- n samples from the prior in one compiled call
+        z = tfd.Normal(0, 1).sample([n, self.n_latent])
+        x_samples, x_probs = self.sample(z)
+        return x_samples
+
+    def generate_replay(self, n_images, dtype=np.float32, batch_size=1000):
+        return replay.generate_replay(self, n_images, dtype, batch_size)
+
+    def frozen_copy(self):
+        return replay.frozen_copy(self)
+
     def generate_and_save_images(self, z, epoch, string):
 
         # ---- samples from the prior
@@ -8,6 +8,7 @@ matplotlib.use('Agg')  # needed when running from commandline
 import matplotlib.pyplot as plt
 import cycler
 import utils
+import replay
 
 
 # ---- plot settings
@@ -71,9 +72,13 @@ class Decoder(tf.keras.Model):
     def __init__(self,
                  n_hidden,
                  n_latent,
+                 bias_initializer=None,
                  **kwargs):
         super(Decoder, self).__init__(**kwargs)
 
+        if bias_initializer is None:
+            bias_initializer = utils.get_bias()
+
         self.decode_z2_to_z1 = BasicBlock(n_hidden[1], n_latent)
 
         # decode z1 to x
@@ -82,7 +87,7 @@ class Decoder(tf.keras.Model):
                 tf.keras.layers.Dense(n_hidden[0], activation=tf.nn.tanh),
                 tf.keras.layers.Dense(n_hidden[0], activation=tf.nn.tanh),
                 tf.keras.layers.Dense(784, activation=None,
-                                      bias_initializer=utils.get_bias())
+                                      bias_initializer=bias_initializer)
             ]
         )
 
@@ -100,11 +105,14 @@ class IWAE(tf.keras.Model):
     def __init__(self,
                  n_hidden,
                  n_latent,
+                 bias_initializer=None,
                  **kwargs):
         super(IWAE, self).__init__(**kwargs)
 
+        self.constructor_args = (n_hidden, n_latent)
+        self.n_latent = n_latent[-1]
         self.encoder = Encoder(n_hidden, n_latent)
-        self.decoder = Decoder(n_hidden, n_latent[0])
+        self.decoder = Decoder(n_hidden, n_latent[0], bias_initializer=bias_initializer)
 
     def GiveReconstruction(self,x,n_samples):
         z1, qz1x, z2, qz2z1 = self.encoder(x, n_samples)
@@ -117,7 +125,32 @@ class IWAE(tf.keras.Model):
         z1, qz1x, z2, qz2z1 = self.encoder(x, n_samples)
         return qz2z1
 
-    def call(self, x, n_samples, beta=1.0):
+    def log_weights(self, x, n_samples, beta=1.0):
+        z1, qz1x, z2, qz2z1 = self.encoder(x, n_samples)
+
+        logits, pxz1, pz1z2 = self.decoder(z1, z2)
+
+        pz2 = tfd.Normal(0, 1)
+
+        lpz2 = tf.reduce_sum(pz2.log_prob(z2), axis=-1)
+
+        lqz2z1 = tf.reduce_sum(qz2z1.log_prob(z2), axis=-1)
+
+        lpz1z2 = tf.reduce_sum(pz1z2.log_prob(z1), axis=-1)
+
+        lqz1x = tf.reduce_sum(qz1x.log_prob(z1), axis=-1)
+
+        lpxz1 = tf.reduce_sum(pxz1.log_prob(x), axis=-1)
+
+        return lpxz1 + lpz1z2 + lpz2 - lqz1x - lqz2z1
+
+    def call(self, x, n_samples, beta=1.0, sample_chunk=None):
+        if sample_chunk is not None and sample_chunk < n_samples:
+            # ---- bound only, the importance samples are drawn sample_chunk at a time
+            log_px = utils.chunked_logmeanexp(lambda n: self.log_weights(x, n, beta), n_samples, sample_chunk)
+            return {"iwae_elbo": tf.reduce_mean(log_px, axis=-1),
+                    "log_px": log_px}
+
         # ---- encode/decode
         z1, qz1x, z2, qz2z1 = self.encoder(x, n_samples)
 
@@ -144,7 +177,8 @@ class IWAE(tf.keras.Model):
 
         # ---- IWAE elbos
         # eq (8): logmeanexp over samples and mean over batch
-        iwae_elbo = tf.reduce_mean(utils.logmeanexp(log_w, axis=0), axis=-1)
+        log_px = utils.logmeanexp(log_w, axis=0)
+        iwae_elbo = tf.reduce_mean(log_px, axis=-1)
 
         # eq (14):
         m = tf.reduce_max(log_w, axis=0, keepdims=True)
@@ -170,6 +204,8 @@ class IWAE(tf.keras.Model):
                 "snis_z1": snis_z1,
                 "snis_z2": snis_z2,
                 "al": al,
+                "log_w": log_w,
+                "log_px": log_px,
                 "logits": logits,
                 "lpxz1": lpxz1,
                 "lpz1z2": lpz1z2,
@@ -286,6 +322,19 @@ class IWAE(tf.keras.Model):
         x_samples, x_probs = self.sample(z)
         return x_samples
 
+    @tf.function(input_signature=[tf.TensorSpec(shape=[], dtype=tf.int32)])
+    def replay_batch(self, n):
+        # ---- n samples from the prior in one compiled call
+        z = tfd.Normal(0, 1).sample([n, self.n_latent])
+        x_samples, x_probs = self.sample(z)
+        return x_samples
+
+    def generate_replay(self, n_images, dtype=np.float32, batch_size=1000):
+        return replay.generate_replay(self, n_images, dtype, batch_size)
+
+    def frozen_copy(self):
+        return replay.frozen_copy(self)
+
     def generate_and_save_posteriors(self, x, y, n_samples, epoch, string):
 
         # ---- posterior snis means
@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tensorflow as tf
+import scoring
+
+
+# ---- novelty of the probe data under every basic node, |bound - reference|,
+# used by Create_New_Component to decide between expansion and a specific node
+
+
+def map_nodes(mixture, fn, indices):
+    # ---- every node's score is independent, so with noveltyWorkers > 1 they are
+    # computed on a thread pool (TF kernels release the GIL) and gathered in order
+    indices = list(indices)
+    if mixture.noveltyWorkers > 1 and len(indices) > 1:
+        with ThreadPoolExecutor(max_workers=min(mixture.noveltyWorkers, len(indices))) as pool:
+            return list(pool.map(fn, indices))
+    return [fn(i) for i in indices]
+
+
+def full_bound(node, data, n_samples, batch_size):
+    # ---- the n_samples IWAE bound over all probe samples
+    return -scoring.score_dataset(node, data, n_samples, batch_size)[0]
+
+
+def proxy_bound(node, data):
+    # ---- single-sample elbo, the cheap first stage
+    return float(tf.reduce_mean(node.Give_LogWeights(tf.cast(data, tf.float32), 1)))
+
+
+def full_score(mixture, data, i):
+    # ---- the original test for one node: full bound against the last training batch's
+    # value. It deliberately keeps that reference rather than the running training
+    # likelihood, so the scores and component weights stay those of the paper's test
+    basicNode = mixture.BasicNodeArr[i]
+    lossSum = full_bound(basicNode, data, mixture.n_samples, mixture.batch_size)
+    return np.abs(lossSum - float(basicNode.logLikelihood))
+
+
+def full_scores(mixture, data):
+    return map_nodes(mixture, lambda i: full_score(mixture, data, i), range(mixture.basic_number))
+
+
+def two_stage_scores(mixture, data):
+    # ---- stage one ranks every basic node with the proxy on a subsample, against the
+    # node's running training likelihood; the proxy only picks the noveltyTopK candidates.
+    # Stage two scores the candidates with full_score, whose reference is the last-batch
+    # value, not the running likelihood, so the returned scores match full_scores.
+    # If the nearest candidate rules out an expansion, the component weights need every
+    # node, so the remaining nodes get the full test too: that call costs full_scores plus
+    # the proxy pass, and since it is the common case this mode is not a general saving.
+    # Only when the candidates call for an expansion are the other nodes skipped, returned
+    # as inf, which is where the mode is cheaper than full_scores.
+    n_sub = min(mixture.noveltySubsample, np.shape(data)[0])
+    subIndex = np.linspace(0, np.shape(data)[0] - 1, n_sub).astype(np.int64)
+    subData = np.asarray(data)[subIndex]
+
+    def proxy_score(i):
+        basicNode = mixture.BasicNodeArr[i]
+        return np.abs(proxy_bound(basicNode, subData) - basicNode.Give_ReferenceLikelihood())
+
+    proxyArr = map_nodes(mixture, proxy_score, range(mixture.basic_number))
+    candidates = list(np.argsort(proxyArr)[:mixture.noveltyTopK])
+
+    arr = np.full(mixture.basic_number, np.inf)
+    arr[candidates] = map_nodes(mixture, lambda i: full_score(mixture, data, i), candidates)
+    if np.min(arr) <= mixture.threshold:
+        rest = [i for i in range(mixture.basic_number) if i not in candidates]
+        arr[rest] = map_nodes(mixture, lambda i: full_score(mixture, data, i), rest)
+    return list(arr)
+
+
+def novelty_scores(mixture, data):
+    start = time.time()
+    if mixture.noveltyMode == "two_stage":
+        arr = two_stage_scores(mixture, data)
+    else:
+        arr = full_scores(mixture, data)
+    took = time.time() - start
+
+    if mixture.noveltyReport == True and mixture.noveltyMode == "two_stage":
+        # ---- time and decision agreement against the full test
+        start = time.time()
+        fullArr = full_scores(mixture, data)
+        fullTook = time.time() - start
+
+        agreeExpansion = (np.min(arr) > mixture.threshold) == (np.min(fullArr) > mixture.threshold)
+        agreeNode = np.argmin(arr) == np.argmin(fullArr)
+        mixture.noveltyStats.append({"two_stage_time": took, "full_time": fullTook,
+                                     "same_expansion": bool(agreeExpansion), "same_nearest_node": bool(agreeNode)})
+        print("novelty test: two-stage {0:.2f}s, full {1:.2f}s, same expansion decision: {2}, same nearest node: {3}"
+              .format(took, fullTook, agreeExpansion, agreeNode))
+
+    return arr
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tensorflow as tf
+
+
+# ---- independent runs of a FiveRun script in parallel processes. The parent relaunches
+# the script once per run with --run_index (or once per branch of a sweep), each child
+# trains alone with a bounded number of TF threads and writes its result to
+# --result_file; the parent collects the results in order for the usual report.
+# With --manifest every finished run is appended to a manifest, and a restarted job only
+# executes the runs that are not in it (a DEGM run interrupted halfway continues from its
+# --checkpoint). Runs are seeded from their index, so skipping some does not change the others.
+# A manifest entry also records a hash of the run's arguments, so a run recorded with
+# other settings is executed again.
+
+# ---- arguments that decide how a run is executed but not its result
+EXECUTION_ARGUMENTS = ("workers", "threads", "gpu", "run_index", "result_file", "manifest",
+                       "checkpoint", "checkpoint_every", "prefix_cache")
+
+
+def add_arguments(parser):
+    parser.add_argument("--workers", type=int, default=1, help="number of runs executed at the same time, each in its own process")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="TF intra-op threads per process, 0 means the TF default, or the cores split over the workers")
+    parser.add_argument("--run_index", type=int, default=-1, help="execute only this run (set by the parallel parent)")
+    parser.add_argument("--result_file", type=str, default="", help="where a single run writes its result")
+    parser.add_argument("--manifest", type=str, default="",
+                        help="append-only record of the finished runs, a restarted job skips them; empty to disable")
+
+
+def setup(args, shared=False):
+    # ---- parallel runs share their datasets, see data_hand.SHARED_DATA; the flag is set
+    # in the environment for the workers and in this process, before any data is loaded
+    if shared == True or args.workers > 1 or args.run_index >= 0:
+        os.environ["DEGM_SHARED_DATA"] = "1"
+        if "data_hand" in sys.modules:
+            sys.modules["data_hand"].SHARED_DATA = True
+    limit_threads(args)
+
+
+def limit_threads(args):
+    threads = args.threads
+    if threads == 0 and args.workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // args.workers)
+    if threads > 0:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(min(threads, 2))
+
+
+def seed_run(runIndex, seed=123):
+    # ---- every run reseeds from its own index, so a run draws the same random numbers
+    # whether it executes alone, after other runs or in a worker process
+    np.random.seed(seed + runIndex)
+    tf.random.set_seed(seed + runIndex)
+
+
+def run_config(args):
+    # ---- hash of every parsed argument except the execution ones; parsed values rather
+    # than sys.argv, so the parent and its workers agree and changed defaults count too
+    config = {name: value for name, value in vars(args).items() if name not in EXECUTION_ARGUMENTS}
+    return hashlib.sha1(json.dumps(sorted(config.items()), default=str).encode()).hexdigest()
+
+
+def completed_runs(args):
+    # ---- {run index: result} of the runs of this script with these arguments recorded in the manifest
+    completed = {}
+    if args.manifest == "" or not os.path.exists(args.manifest):
+        return completed
+    script = os.path.basename(sys.argv[0])
+    config = run_config(args)
+    with open(args.manifest) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # ---- a line cut short by a crash
+                continue
+            if entry["script"] == script and entry.get("config") == config:
+                completed[entry["run"]] = entry["result"]
+    return completed
+
+
+def record_run(args, runIndex, result):
+    # ---- one line per run, appended in a single write; parallel workers share the file
+    if args.manifest == "":
+        return
+    line = json.dumps({"script": os.path.basename(sys.argv[0]), "config": run_config(args), "run": runIndex,
+                       "result": float(np.asarray(result))}) + "\n"
+    directory = os.path.dirname(args.manifest)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    with open(args.manifest, "a+") as f:
+        # ---- start a new line after a record cut short by a crash
+        if f.tell() > 0:
+            f.seek(f.tell() - 1)
+            if f.read(1) != "\n":
+                line = "\n" + line
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def run_indices(args, run_count):
+    if args.run_index >= 0:
+        return [args.run_index]
+    if args.workers > 1:
+        return []
+    completed = completed_runs(args)
+    if len(completed) > 0:
+        print("skipping the finished runs {0}".format(sorted(completed)))
+    return [runIndex for runIndex in range(run_count) if runIndex not in completed]
+
+
+def _launch(script, name, extraArgs, outDir):
+    resultFile = os.path.join(outDir, "{0}.json".format(name))
+    logFile = os.path.join(outDir, "{0}.log".format(name))
+    # ---- later occurrences of an option win in argparse, the parent's own flags are overridden
+    command = [sys.executable, script] + sys.argv[1:] + extraArgs + ["--result_file", resultFile]
+    with open(logFile, "w") as log:
+        code = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+    if code != 0:
+        raise RuntimeError("{0} failed with exit code {1}, see {2}".format(name, code, logFile))
+    with open(resultFile) as f:
+        return json.load(f)["result"]
+
+
+def run_branches(args, branches, script=None):
+    # ---- runs the script once per (name, extra arguments) branch on args.workers workers,
+    # returns the branch results in the given order
+    script = script or os.path.abspath(sys.argv[0])
+    threads = args.threads or max(1, (os.cpu_count() or 1) // max(1, args.workers))
+    outDir = tempfile.mkdtemp(prefix="runs_")
+    print("running {0} processes on {1} workers, {2} threads each, logs in {3}".format(len(branches), args.workers, threads, outDir))
+    with ThreadPoolExecutor(max(1, args.workers)) as pool:
+        futures = [pool.submit(_launch, script, name, ["--workers", "1", "--threads", str(threads)] + extraArgs, outDir)
+                   for name, extraArgs in branches]
+        return [future.result() for future in futures]
+
+
+def run_parallel(args, run_count, script=None):
+    # ---- the results of all runs when this process is the parallel parent, the results of
+    # the runs already in the manifest when it runs them itself, and [] in a worker
+    if args.run_index >= 0:
+        return []
+    completed = completed_runs(args)
+    if args.workers <= 1:
+        return [completed[runIndex] for runIndex in range(run_count) if runIndex in completed]
+    pending = [runIndex for runIndex in range(run_count) if runIndex not in completed]
+    results = run_branches(args, [("run{0}".format(runIndex), ["--run_index", str(runIndex)]) for runIndex in pending], script)
+    completed.update(zip(pending, results))
+    return [completed[runIndex] for runIndex in range(run_count)]
+
+
+def write_result(path, result):
+    with open(path, "w") as f:
+        json.dump({"result": result}, f)
+
+
+def save_result(args, resultsArr):
+    if args.result_file != "":
+        write_result(args.result_file, float(np.asarray(resultsArr[-1])))
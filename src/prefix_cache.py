@@ -0,0 +1,51 @@
+import hashlib
+import json
+import os
+import graph_checkpoint
+import score_cache
+
+
+# ---- hyperparameters that cannot influence the first task, e.g. the expansion
+# threshold is first used when the second component is created
+FIRST_TASK_INDEPENDENT = ("threshold",)
+
+
+# ---- content-addressed store of trained task prefixes. The mixture state after task k
+# is saved under a hash of (mixture class, hyperparameters, fingerprints of the data of
+# tasks 0..k, seed, k), so any experiment that trains the same model on the same first
+# tasks can start from the deepest prefix another experiment already trained.
+class PrefixCache():
+    def __init__(self, root="./data/prefix_cache"):
+        self.root = root
+
+    def keys(self, model, hyperparams, taskData, seed):
+        # ---- one key per task index
+        dataFingerprints = [score_cache.dataset_fingerprint(x) for x in taskData]
+        keys = []
+        for taskIndex in range(len(taskData)):
+            params = dict(hyperparams)
+            if taskIndex == 0:
+                for name in FIRST_TASK_INDEPENDENT:
+                    params.pop(name, None)
+            description = json.dumps([type(model).__name__, sorted(params.items()),
+                                      dataFingerprints[:taskIndex + 1], seed, taskIndex], default=str)
+            keys.append(hashlib.sha1(description.encode()).hexdigest())
+        return keys
+
+    def path(self, key):
+        return os.path.join(self.root, "{0}.npz".format(key))
+
+    def save(self, model, key, extra=None):
+        graph_checkpoint.save_graph(model, self.path(key), extra)
+
+    def restore_deepest(self, model, keys):
+        # ---- (index of the first task still to train, extra dict of the restored state).
+        # A task 0 prefix may come from an experiment with another threshold, so the
+        # hyperparameters left out of its key keep the values of this experiment
+        for taskIndex in reversed(range(len(keys))):
+            if os.path.exists(self.path(keys[taskIndex])):
+                extra = graph_checkpoint.restore_graph(model, self.path(keys[taskIndex]),
+                                                       keep_attributes=FIRST_TASK_INDEPENDENT)
+                print("resuming from the cached prefix of tasks 0-{0}".format(taskIndex))
+                return taskIndex + 1, extra
+        return 0, {}
@@ -0,0 +1,146 @@
+import numpy as np
+import tensorflow as tf
+
+
+# ---- generative replay from a frozen model. The model provides replay_batch(n), a
+# compiled draw of n images from its prior; these helpers call it in large batches
+# instead of one generate_samples call and one list append per image.
+
+
+def replay_batches(model, n_images, batch_size=1000):
+    n_done = 0
+    while n_done < n_images:
+        n = min(batch_size, n_images - n_done)
+        yield model.replay_batch(tf.constant(n, dtype=tf.int32)).numpy()
+        n_done += n
+
+
+def generate_replay(model, n_images, dtype=np.float32, batch_size=1000):
+    # ---- n_images samples written into one preallocated [n_images, 784] array
+    out = None
+    n_done = 0
+    for batch in replay_batches(model, n_images, batch_size):
+        if out is None:
+            out = np.empty((n_images, np.shape(batch)[1]), dtype=dtype)
+        out[n_done:n_done + np.shape(batch)[0]] = batch
+        n_done += np.shape(batch)[0]
+    if out is None:
+        out = np.empty((0, 784), dtype=dtype)
+    return out
+
+
+def frozen_copy(model):
+    # ---- a separate model with model's current weights, used as the fixed replay
+    # generator while model itself trains on the next task
+    copy = type(model)(*model.constructor_args)
+    copy(tf.zeros([1, 784]), 1)
+    copy.set_weights(model.get_weights())
+    copy.trainable = False
+    return copy
+
+
+def node_generator(nodes):
+    # ---- replay from frozen mixture nodes, the n images split evenly across them
+    def generate(n):
+        n = int(n)
+        counts = [n // len(nodes) + (1 if i < n % len(nodes) else 0) for i in range(len(nodes))]
+        batches = [tf.cast(node.replay_batch(tf.constant(count, dtype=tf.int32)), tf.float32)
+                   for node, count in zip(nodes, counts) if count > 0]
+        return tf.concat(batches, axis=0)
+    return generate
+
+
+@tf.function(experimental_relax_shapes=True)
+def _row_normal(seeds, n_latent):
+    return tf.vectorized_map(lambda seed: tf.random.stateless_normal([n_latent], seed=seed), seeds)
+
+
+@tf.function(experimental_relax_shapes=True)
+def _row_uniform(seeds, n_features):
+    return tf.vectorized_map(lambda seed: tf.random.stateless_uniform([n_features], seed=seed), seeds)
+
+
+# ---- replay memory that stores no images. Every entry is an index into a block of rows
+# drawn from one frozen decoder (decode_fn(z) -> Bernoulli means, e.g. the probs of
+# IWAE.sample or VAENode.Give_PriorProbs). With mode "seed" only the block table is kept
+# and the latent code and pixel noise of row i come from stateless RNG seeds derived
+# from i; with mode "latent" the latent codes are kept as float16. get(index) regenerates
+# the same images for the same indices, so the store can be batched like real data.
+# Every block pins its decoder: with decode_fn a closure over a frozen model, memory grows
+# by one model per task. Given to add, that model's weights are counted in nbytes, which
+# is then the store's real footprint and not only its latents and block table.
+class CompactReplayStore():
+    def __init__(self, n_latent=100, n_features=784, mode="seed", seed=0):
+        self.n_latent = n_latent
+        self.n_features = n_features
+        self.mode = mode
+        self.seed = seed
+        self.decoders = []
+        self.decoderBytes = []
+        self.blockStarts = []
+        self.count = 0
+        self.latents = np.zeros((0, n_latent), dtype=np.float16)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.latents.nbytes + 8 * len(self.blockStarts) + sum(self.decoderBytes)
+
+    def _seeds(self, index, stream):
+        return tf.constant(np.stack([np.full(len(index), self.seed * 4 + stream), index], axis=1), dtype=tf.int64)
+
+    def add(self, decode_fn, n_images, model=None):
+        # ---- model is what decode_fn keeps alive, e.g. the frozen copy it samples from
+        self.decoders.append(decode_fn)
+        self.decoderBytes.append(0 if model is None else
+                                 sum(int(np.prod(w.shape)) * w.dtype.size for w in model.weights))
+        self.blockStarts.append(self.count)
+        index = np.arange(self.count, self.count + n_images)
+        self.count = self.count + n_images
+        if self.mode == "latent":
+            z = _row_normal(self._seeds(index, 0), self.n_latent).numpy().astype(np.float16)
+            self.latents = np.concatenate((self.latents, z), axis=0)
+
+    def get(self, index):
+        index = np.asarray(index, dtype=np.int64)
+        out = np.empty((len(index), self.n_features), dtype=np.float32)
+        blocks = np.searchsorted(self.blockStarts, index, side="right") - 1
+        for block in np.unique(blocks):
+            rows = np.flatnonzero(blocks == block)
+            blockIndex = index[rows]
+            if self.mode == "latent":
+                z = tf.constant(self.latents[blockIndex], dtype=tf.float32)
+            else:
+                z = _row_normal(self._seeds(blockIndex, 0), self.n_latent)
+            probs = self.decoders[block](z)
+            u = _row_uniform(self._seeds(blockIndex, 1), self.n_features)
+            out[rows] = tf.cast(u < probs, tf.float32).numpy()
+        return out
+
+    def generator(self, seed=0):
+        # ---- generator(n) for input_pipeline.ReplayMixingStream: walks a shuffled
+        # permutation of the store n entries at a time, reshuffling after every pass
+        rng = np.random.RandomState(seed)
+        state = {"order": rng.permutation(self.count), "position": 0}
+
+        def generate(n):
+            n = int(n)
+            index = []
+            while len(index) < n:
+                if state["position"] >= self.count:
+                    state["order"] = rng.permutation(self.count)
+                    state["position"] = 0
+                take = state["order"][state["position"]:state["position"] + n - len(index)]
+                state["position"] = state["position"] + len(take)
+                index.extend(take)
+            return tf.constant(self.get(index))
+        return generate
+
+
+def buffer_generator(buffer, balanced=True):
+    # ---- generator(n) for input_pipeline.ReplayMixingStream drawing from a replay_buffer.ReplayBuffer
+    def generate(n):
+        return tf.constant(buffer.sample(int(n), balanced).astype(np.float32))
+    return generate
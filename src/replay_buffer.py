@@ -0,0 +1,120 @@
+import numpy as np
+
+
+def balanced_counts(total, n_groups):
+    # ---- total rows split over n_groups, the remainder going to the last group
+    share = total // n_groups
+    return [share] * (n_groups - 1) + [total - share * (n_groups - 1)]
+
+
+# ---- bounded replay memory. All rows live in one array preallocated from a byte budget;
+# the capacity is split into equal per-task quotas, and every task keeps a reservoir
+# sample of the rows offered to it. Quotas are soft: a task may fill slots nobody else
+# uses, and only gives rows back when a task under its quota needs the space, so the
+# buffer stays full whenever enough rows were offered. Inserting a row and sampling a
+# row are O(1).
+# numpy only, so the TF1 BatchEnsemble script can use it as well.
+class ReplayBuffer():
+    def __init__(self, max_bytes, row_shape=(784,), dtype=np.uint8, seed=0):
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        rowBytes = int(np.prod(self.row_shape)) * self.dtype.itemsize
+        self.capacity = int(max_bytes // rowBytes)
+        self.data = np.zeros((self.capacity,) + self.row_shape, dtype=self.dtype)
+        self.freeSlots = list(range(self.capacity - 1, -1, -1))
+        # ---- per task, the data rows it holds in slots[task][:counts[task]]; a row leaves
+        # by swapping it with the last one, so no per-call list conversion is needed
+        self.slots = {}
+        self.counts = {}
+        self.seen = {}
+        self.quotas = {}
+        self.rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.capacity - len(self.freeSlots)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def _add_task(self, task):
+        self.slots[task] = np.zeros(self.capacity, dtype=np.int64)
+        self.counts[task] = 0
+        self.seen[task] = 0
+        quotas = balanced_counts(self.capacity, len(self.slots))
+        for t, quota in zip(self.slots, quotas):
+            self.quotas[t] = quota
+
+    def _reclaim(self, task):
+        # ---- a free slot for a task under its quota, taken from the task furthest over
+        # its own; dropping a randomly chosen row keeps the remaining rows of that task a
+        # uniform sample of everything it was offered
+        if len(self.freeSlots) > 0:
+            return self.freeSlots.pop()
+        if self.counts[task] >= self.quotas[task]:
+            return None
+        excess = {t: self.counts[t] - self.quotas[t] for t in self.slots}
+        donor = max(excess, key=excess.get)
+        if excess[donor] <= 0:
+            return None
+        slots = self.slots[donor]
+        last = self.counts[donor] - 1
+        j = self.rng.randint(last + 1)
+        slot = slots[j]
+        slots[j] = slots[last]
+        self.counts[donor] = last
+        return slot
+
+    def add(self, X, task):
+        if task not in self.slots:
+            self._add_task(task)
+        X = np.asarray(X).reshape((-1,) + self.row_shape)
+        slots = self.slots[task]
+
+        # ---- store rows while there is room for the task, free slots first, then rows
+        # reclaimed from tasks holding more than their quota
+        n_fill = 0
+        while n_fill < np.shape(X)[0]:
+            slot = self._reclaim(task)
+            if slot is None:
+                break
+            self.data[slot] = X[n_fill]
+            slots[self.counts[task]] = slot
+            self.counts[task] = self.counts[task] + 1
+            n_fill = n_fill + 1
+        self.seen[task] = self.seen[task] + n_fill
+
+        # ---- then reservoir sampling: row number s replaces a random kept row with
+        # probability count / (s + 1)
+        rest = X[n_fill:]
+        count = self.counts[task]
+        if np.shape(rest)[0] > 0 and count > 0:
+            seenIndex = self.seen[task] + np.arange(np.shape(rest)[0])
+            j = (self.rng.random_sample(np.shape(rest)[0]) * (seenIndex + 1)).astype(np.int64)
+            keep = j < count
+            # ---- later rows overwrite earlier ones in the same slot, as inserting one by one would
+            self.data[slots[j[keep]]] = rest[keep]
+        self.seen[task] = self.seen[task] + np.shape(rest)[0]
+
+    def sample(self, n, balanced=True):
+        # ---- n rows drawn with replacement, either an equal share from every task or
+        # uniformly over all stored rows
+        tasks = [t for t in self.slots if self.counts[t] > 0]
+        if len(tasks) == 0:
+            raise ValueError("cannot sample from an empty replay buffer, add rows first")
+        counts = np.asarray([self.counts[t] for t in tasks])
+        if balanced == True:
+            index = [self.slots[t][self.rng.randint(count, size=share)]
+                     for t, count, share in zip(tasks, counts, balanced_counts(n, len(tasks)))]
+            index = np.concatenate(index)
+        else:
+            # ---- a position in the tasks' filled prefixes laid end to end
+            position = self.rng.randint(np.sum(counts), size=n)
+            ends = np.cumsum(counts)
+            taskIndex = np.searchsorted(ends, position, side="right")
+            offset = position - (ends - counts)[taskIndex]
+            index = np.empty(n, dtype=np.int64)
+            for i, t in enumerate(tasks):
+                mask = taskIndex == i
+                index[mask] = self.slots[t][offset[mask]]
+        return self.data[index]
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import numpy as np
+import tensorflow as tf
+import input_pipeline
+
+
+def _own_layers(node):
+    layers = [node.specificEncoder_net, node.specificEncoder_mu, node.specificEncoder_std,
+              node.SpecificDecoder_layer1, node.SpecificDecoder_output]
+    if node.IsBasic == True:
+        layers = [node.SharedEncoder, node.SharedDecoder] + layers
+    return layers
+
+
+def node_fingerprint(node):
+    # ---- hash of everything a node's score depends on: its own layers and,
+    # for a specific node, the basic nodes it mixes and their component weights
+    h = hashlib.sha1()
+    for layer in _own_layers(node):
+        for w in layer.get_weights():
+            h.update(np.ascontiguousarray(w).tobytes())
+    if node.IsBasic == False:
+        # ---- the CNDPM/LIMix nodes leave basicCount at 0 and only read BasicNodes[0]
+        basicCount = node.basicCount if node.basicCount > 0 else 1
+        for basicNode in node.BasicNodes[:basicCount]:
+            h.update(node_fingerprint(basicNode).encode())
+        h.update(np.asarray(node.ComponentWeights, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def dataset_fingerprint(X):
+    if isinstance(X, input_pipeline.PackedBits):
+        # ---- packed test sets are hashed as stored, 98 bytes per image
+        h = hashlib.sha1()
+        h.update(str(("packed", X.shape)).encode())
+        h.update(np.ascontiguousarray(X.packed).tobytes())
+        return h.hexdigest()
+    X = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+    h = hashlib.sha1()
+    h.update(str(X.shape).encode())
+    h.update(X.tobytes())
+    return h.hexdigest()
+
+
+# ---- per-node, per-split NLL keyed by (node weights, dataset, L, seed).
+# A frozen node on a fixed test split always maps to the same key, so after
+# task t only the new node's scores are computed. With a path the scores are
+# also kept on disk and reused by later runs.
+class NodeScoreCache():
+    def __init__(self, path=None, seed=None):
+        self.path = path
+        self.seed = seed
+        self.scores = {}
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.scores = json.load(f)
+
+    def key(self, node, X, n_samples):
+        return "{0}_{1}_{2}_{3}".format(node_fingerprint(node), dataset_fingerprint(X), n_samples, self.seed)
+
+    def score(self, node, X, n_samples, score_fn):
+        key = self.key(node, X, n_samples)
+        if key in self.scores:
+            self.hits = self.hits + 1
+            return self.scores[key]
+
+        self.misses = self.misses + 1
+        if self.seed is not None:
+            tf.random.set_seed(self.seed)
+        value = float(score_fn())
+        self.scores[key] = value
+        self.save()
+        return value
+
+    def save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.scores, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,38 @@
+import threading
+import weakref
+import numpy as np
+import tensorflow as tf
+import input_pipeline
+
+
+# ---- one compiled scoring function per (node, n_samples); the input signature
+# leaves the batch dimension open, so the remainder batch reuses the same trace
+_score_fns = weakref.WeakKeyDictionary()
+_score_fns_lock = threading.Lock()
+
+
+def _get_score_fn(node, n_samples):
+    # ---- novelty.map_nodes may ask for functions from several threads at once
+    with _score_fns_lock:
+        fns = _score_fns.setdefault(node, {})
+        if n_samples not in fns:
+            node_ref = weakref.ref(node)
+
+            def score(x):
+                return -node_ref().Give_LogLikelihood(x, n_samples)
+
+            fns[n_samples] = tf.function(score, input_signature=[tf.TensorSpec(shape=[None, None], dtype=tf.float32)])
+        return fns[n_samples]
+
+
+def score_dataset(node, X, n_samples, batch_size=20):
+    # ---- per-example NLL of every row of X (an array or input_pipeline.PackedBits) under node, including the last len(X) % batch_size rows
+    score = _get_score_fn(node, n_samples)
+
+    dataset = input_pipeline.batched_dataset(X, batch_size)
+
+    nll = np.concatenate([score(x_batch).numpy() for x_batch in dataset], axis=0)
+
+    # ---- weighting every batch by its size, so the short remainder batch counts exactly
+    mean = np.mean(nll.astype(np.float64))
+    return mean, nll
@@ -0,0 +1,77 @@
+import tensorflow as tf
+from tensorflow_probability import distributions as tfd
+
+
+def _stack_dense(layers):
+    # ---- [K, n_in, n_out] kernels and [K, n_out] biases of K Dense layers
+    kernel = tf.stack([layer.kernel for layer in layers])
+    bias = tf.stack([layer.bias for layer in layers])
+    return kernel, bias
+
+
+# ---- the shared encoders/decoders of K basic nodes packed into stacked tensors,
+# so all K components run as one batched matmul instead of a Python loop over nodes
+class StackedBasicNodes():
+    def __init__(self):
+        self.key = None
+        self.params = None
+
+    def _stack(self, nodes):
+        return {"SharedEncoder": _stack_dense([node.SharedEncoder for node in nodes]),
+                "specificEncoder_net": _stack_dense([node.specificEncoder_net for node in nodes]),
+                "specificEncoder_mu": _stack_dense([node.specificEncoder_mu for node in nodes]),
+                "specificEncoder_std": _stack_dense([node.specificEncoder_std for node in nodes]),
+                "SharedDecoder": _stack_dense([node.SharedDecoder for node in nodes])}
+
+    def pack(self, basicNodes, basicCount):
+        nodes = basicNodes[:basicCount]
+        isFrozen = all(not node.SharedEncoder.trainable for node in nodes)
+        if not isFrozen:
+            # ---- a basic node is still training, read its current weights every call
+            self.key = None
+            return self._stack(nodes)
+
+        # ---- frozen nodes never change, pack them once outside of any trace
+        key = tuple(id(node) for node in nodes)
+        if key != self.key:
+            with tf.init_scope():
+                self.params = self._stack(nodes)
+            self.key = key
+        return self.params
+
+    def encode(self, x, basicNodes, basicCount, weights, n_samples):
+        params = self.pack(basicNodes, basicCount)
+        weights = tf.reshape(tf.cast(weights, tf.float32), [-1])[:basicCount]
+
+        kernel, bias = params["SharedEncoder"]
+        x = tf.cast(x, kernel.dtype)
+        output = tf.nn.tanh(tf.einsum('bi,kio->kbo', x, kernel) + bias[:, None, :])
+        kernel, bias = params["specificEncoder_net"]
+        output = tf.nn.tanh(tf.einsum('kbi,kio->kbo', output, kernel) + bias[:, None, :])
+        kernel, bias = params["specificEncoder_mu"]
+        q_mu = tf.einsum('kbi,kio->kbo', output, kernel) + bias[:, None, :]
+        kernel, bias = params["specificEncoder_std"]
+        q_std = tf.exp(tf.einsum('kbi,kio->kbo', output, kernel) + bias[:, None, :])
+
+        # ---- z: [n_samples, K, batch, n_latent]
+        qzx = tfd.Normal(q_mu, q_std + 1e-6)
+        z = qzx.sample(n_samples)
+
+        pz = tfd.Normal(0, 1)
+        lpz = tf.reduce_sum(pz.log_prob(z), axis=-1)
+        lqzx = tf.reduce_sum(qzx.log_prob(z), axis=-1)
+        kl = (lpz - lqzx)
+
+        z_sum = tf.reduce_sum(z * weights[None, :, None, None], axis=1)
+        kl_sum = tf.reduce_sum(kl * weights[None, :, None], axis=1)
+        return z_sum, kl_sum
+
+    def decode(self, z_sum, basicNodes, basicCount, weights):
+        params = self.pack(basicNodes, basicCount)
+        weights = tf.reshape(tf.cast(weights, tf.float32), [-1])[:basicCount]
+
+        # ---- every basic node's SharedDecoder applied to the same z_sum, then mixed
+        kernel, bias = params["SharedDecoder"]
+        decoderOutput = tf.nn.tanh(tf.einsum('sbi,kio->ksbo', z_sum, kernel) + bias[:, None, None, :])
+        sumX = tf.reduce_sum(decoderOutput * weights[:, None, None, None], axis=0)
+        return sumX
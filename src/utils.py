@@ -1,3 +1,4 @@
+import hashlib
 import tensorflow as tf
 import numpy as np
 from tensorflow import keras
@@ -8,22 +9,97 @@ def logmeanexp(log_w, axis):
     return tf.math.log(tf.reduce_mean(tf.exp(log_w - max), axis=axis)) + max
 
 
-def get_bias():
-    # ---- For initializing the bias in the final Bernoulli layer for p(x|z)
-    (Xtrain, ytrain), (_, _) = keras.datasets.mnist.load_data()
-    Ntrain = Xtrain.shape[0]
+def _chunked_fold(log_w_fn, n_samples, chunk_size, first, combine):
+    # ---- folds log_w_fn over the chunks in order. The full chunks after the first one run
+    # in a tf.while_loop with parallel_iterations=1 and the remainder chunk is drawn only
+    # after the loop, so under tf.function too a single chunk of log weights is alive at a time
+    state = first(log_w_fn(chunk_size))
+    n_full = n_samples // chunk_size
+    if n_full > 1:
+        _, state = tf.while_loop(lambda i, state: i < n_full,
+                                 lambda i, state: (i + 1, combine(state, log_w_fn(chunk_size))),
+                                 (tf.constant(1), state), parallel_iterations=1)
+    remainder = n_samples - n_full * chunk_size
+    if remainder > 0:
+        with tf.control_dependencies(list(state)):
+            log_w = log_w_fn(remainder)
+        state = combine(state, log_w)
+    return state
 
-    # ---- reshape to vectors
-    Xtrain = Xtrain.reshape(Ntrain, -1) / 255
 
-    train_mean = np.mean(Xtrain, axis=0)
+def chunked_logmeanexp(log_w_fn, n_samples, chunk_size=None):
+    # ---- logmeanexp over axis 0 of log_w_fn(n_samples), drawing the importance
+    # samples chunk_size at a time. Only a running max and a running sum of
+    # exp(log_w - max) per example are kept, so peak memory is bounded by the
+    # chunk and the result equals the one-shot logmeanexp.
+    if chunk_size is None or chunk_size >= n_samples:
+        return logmeanexp(log_w_fn(n_samples), axis=0)
 
-    bias = -np.log(1. / np.clip(train_mean, 0.001, 0.999) - 1.)
+    def first(log_w):
+        chunk_max = tf.reduce_max(log_w, axis=0)
+        return (chunk_max, tf.reduce_sum(tf.exp(log_w - chunk_max), axis=0))
 
-    return tf.constant_initializer(bias)
+    def combine(state, log_w):
+        running_max, running_sum = state
+        new_max = tf.maximum(running_max, tf.reduce_max(log_w, axis=0))
+        running_sum = running_sum * tf.exp(running_max - new_max) + \
+            tf.reduce_sum(tf.exp(log_w - new_max), axis=0)
+        return (new_max, running_sum)
+
+    running_max, running_sum = _chunked_fold(log_w_fn, n_samples, chunk_size, first, combine)
+    return tf.math.log(running_sum / n_samples) + running_max
+
+
+def chunked_mean(log_w_fn, n_samples, chunk_size=None):
+    # ---- same chunking as chunked_logmeanexp, for the plain elbo (mean over samples)
+    if chunk_size is None or chunk_size >= n_samples:
+        return tf.reduce_mean(log_w_fn(n_samples), axis=0)
+
+    running_sum, = _chunked_fold(log_w_fn, n_samples, chunk_size,
+                                 lambda log_w: (tf.reduce_sum(log_w, axis=0),),
+                                 lambda state, log_w: (state[0] + tf.reduce_sum(log_w, axis=0),))
+    return running_sum / n_samples
+
+
+# ---- logit of the mean training image, computed once per process for every dataset;
+# named keras datasets are keyed by name, given data by a fingerprint of its content
+_bias_cache = {}
+_keras_datasets = {"mnist": keras.datasets.mnist, "fashion": keras.datasets.fashion_mnist}
+
+
+def data_fingerprint(X):
+    X = np.ascontiguousarray(X)
+    h = hashlib.sha1()
+    h.update(str((X.shape, X.dtype.str)).encode())
+    h.update(X.tobytes())
+    return h.hexdigest()
+
+
+def get_bias(dataset="mnist", X=None):
+    # ---- For initializing the bias in the final Bernoulli layer for p(x|z).
+    # X is the dataset's training data, uint8 pixels or in [0, 1]; without it the named keras dataset is loaded.
+    key = dataset if X is None else (dataset, data_fingerprint(X))
+    if key not in _bias_cache:
+        if X is None:
+            (Xtrain, ytrain), (_, _) = _keras_datasets[dataset].load_data()
+            Ntrain = Xtrain.shape[0]
+
+            # ---- reshape to vectors
+            X = Xtrain.reshape(Ntrain, -1) / 255
+
+        train_mean = np.mean(np.reshape(X, (np.shape(X)[0], -1)), axis=0)
+        if np.asarray(X).dtype == np.uint8:
+            train_mean = train_mean / 255.
+
+        _bias_cache[key] = -np.log(1. / np.clip(train_mean, 0.001, 0.999) - 1.)
+
+    return tf.constant_initializer(_bias_cache[key])
 
 
 def bernoullisample(x):
+    # ---- uint8 pixels are scaled to [0, 1] first
+    if x.dtype == np.uint8:
+        x = x / 255.
     return np.random.binomial(1, x, size=x.shape).astype('float32')
 
 
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+import utils
+import graph_checkpoint
+import DMix_Weighted
+
+
+def make_model(x):
+    model = DMix_Weighted.DMix_Weighted(200, 50)
+    model.biasInitializer = utils.get_bias("test", x)
+    model.n_samples = 1
+    model.Create_New_Component(tf.zeros([1, 784]), x, True)
+    return model
+
+
+def train(model, optimizer, x, steps):
+    node = model.currentNode
+    for _ in range(steps):
+        with tf.GradientTape() as tape:
+            loss = -node.Build_BasicNode(x, 1)
+        optimizer.apply_gradients(zip(tape.gradient(loss, node.trainable_weights), node.trainable_weights))
+
+
+def optimizer_arrays(optimizer, variables):
+    # ---- the step count and Adam's m and v of every variable
+    if hasattr(optimizer, "get_slot_names"):
+        state = [optimizer.get_slot(var, name) for var in variables for name in ("m", "v")]
+    else:
+        state = [v for v in optimizer.variables if v is not optimizer.iterations]
+    return [optimizer.iterations.numpy()] + [v.numpy() for v in state]
+
+
+@pytest.mark.parametrize("make_optimizer", [tf.keras.optimizers.legacy.Adam, tf.keras.optimizers.Adam])
+def test_resume_restores_optimizer_state(tmp_path, make_optimizer):
+    x = np.random.RandomState(0).rand(20, 784).astype(np.float32)
+    path = str(tmp_path / "run0.npz")
+
+    model = make_model(x)
+    optimizer = make_optimizer(1e-3)
+    train(model, optimizer, x, 3)
+    graph_checkpoint.save_graph(model, path, {"step": 3}, optimizer)
+
+    resumed = make_model(x)
+    resumedOptimizer = make_optimizer(1e-3)
+    graph_checkpoint.restore_graph(resumed, path, optimizer=resumedOptimizer)
+
+    expected = optimizer_arrays(optimizer, model.currentNode.trainable_variables)
+    restored = optimizer_arrays(resumedOptimizer, resumed.currentNode.trainable_variables)
+    assert len(restored) == len(expected) > 1
+    assert np.any(expected[1] != 0)
+    for a, b in zip(expected, restored):
+        np.testing.assert_array_equal(a, b)
+
+    # ---- the restored optimizer keeps training the restored node
+    train(resumed, resumedOptimizer, x, 1)
+    assert resumedOptimizer.iterations.numpy() == 4
@@ -0,0 +1,23 @@
+import argparse
+import parallel_runs
+
+
+def parse(manifest, *argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=500)
+    parser.add_argument("--n_samples", type=int, default=5)
+    parallel_runs.add_arguments(parser)
+    return parser.parse_args(["--manifest", manifest] + list(argv))
+
+
+def test_changed_argument_reruns(tmp_path):
+    manifest = str(tmp_path / "manifest.jsonl")
+    parallel_runs.record_run(parse(manifest), 0, -91.5)
+    parallel_runs.record_run(parse(manifest), 1, -92.5)
+
+    assert parallel_runs.completed_runs(parse(manifest)) == {0: -91.5, 1: -92.5}
+    assert parallel_runs.run_indices(parse(manifest), 3) == [2]
+    # ---- execution arguments do not change the result, the others do
+    assert parallel_runs.completed_runs(parse(manifest, "--workers", "4", "--threads", "2")) == {0: -91.5, 1: -92.5}
+    assert parallel_runs.completed_runs(parse(manifest, "--epochs", "100")) == {}
+    assert parallel_runs.run_indices(parse(manifest, "--n_samples", "50"), 3) == [0, 1, 2]
@@ -0,0 +1,43 @@
+import numpy as np
+import tensorflow as tf
+import utils
+import prefix_cache
+import DMix_Weighted
+
+
+def make_model(threshold, taskX):
+    model = DMix_Weighted.DMix_Weighted(200, 50)
+    model.biasInitializer = utils.get_bias("test", taskX[0])
+    model.threshold = threshold
+    model.n_samples = 1
+    return model
+
+
+def prefix_keys(cache, model, taskX):
+    return cache.keys(model, {"n_samples": 1, "threshold": model.threshold}, taskX, 0)
+
+
+def test_threshold_survives_shared_first_task_prefix(tmp_path):
+    rng = np.random.RandomState(0)
+    taskX = [rng.rand(20, 784).astype(np.float32) for _ in range(2)]
+    cache = prefix_cache.PrefixCache(str(tmp_path))
+
+    # ---- the experiment with threshold 40 trains task 0 and publishes the prefix
+    first = make_model(40, taskX)
+    first.Create_New_Component(tf.zeros([1, 784]), taskX[0], True)
+    firstKeys = prefix_keys(cache, first, taskX)
+    cache.save(first, firstKeys[0], {"taskIndex": 0, "step": 3})
+
+    # ---- the experiment with threshold 60 shares the task 0 prefix, not the task 1 one
+    second = make_model(60, taskX)
+    secondKeys = prefix_keys(cache, second, taskX)
+    assert secondKeys[0] == firstKeys[0]
+    assert secondKeys[1] != firstKeys[1]
+
+    firstTask, extra = cache.restore_deepest(second, secondKeys)
+    assert firstTask == 1
+    assert extra["step"] == 3
+    assert second.threshold == 60
+    assert len(second.AllNodeArr) == 1
+    for a, b in zip(first.AllNodeArr[0].get_weights(), second.AllNodeArr[0].get_weights()):
+        np.testing.assert_array_equal(a, b)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import replay_buffer
+
+
+def rows(n, value):
+    return np.full((n, 784), value, dtype=np.uint8)
+
+
+def test_empty_buffer_sample_raises():
+    with pytest.raises(ValueError):
+        replay_buffer.ReplayBuffer(100 * 784).sample(5)
+
+
+def test_unused_quota_goes_to_other_tasks():
+    buffer = replay_buffer.ReplayBuffer(100 * 784)
+    buffer.add(rows(80, 1), 0)
+    buffer.add(rows(30, 2), 1)
+    assert len(buffer) == 100
+    assert buffer.counts == {0: 70, 1: 30}
+
+    buffer.add(rows(200, 3), 2)
+    buffer.add(rows(200, 2), 1)
+    assert len(buffer) == 100
+    assert buffer.counts == {0: 33, 1: 33, 2: 34}
+    for task in buffer.slots:
+        stored = buffer.data[buffer.slots[task][:buffer.counts[task]]]
+        assert np.all(stored == task + 1)
+
+    assert sorted(np.unique(buffer.sample(300, balanced=False)[:, 0])) == [1, 2, 3]
+    np.testing.assert_array_equal(buffer.sample(9)[:, 0], [1, 1, 1, 2, 2, 2, 3, 3, 3])